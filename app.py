@@ -1,5 +1,13 @@
 import dash
+from flask_compress import Compress
+
+from apps import data, metrics, options
 
 app = dash.Dash()
 server = app.server
+# gzip the JSON responses: the repeated names in the tooltips compress well
+Compress(server)
+data.register(server)
+metrics.register(server)
+options.register(server)
 app.config.suppress_callback_exceptions = True
\ No newline at end of file
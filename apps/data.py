@@ -0,0 +1,574 @@
+"""Shared GTD data store.
+
+The CSV is parsed once per process and the resulting frame is shared by the
+world and country pages, so every worker holds a single copy of the data.
+
+The cleaned table is also written to a Feather (Arrow IPC) file next to the
+CSV.  Later processes memory-map that file instead of re-parsing the CSV; it
+is rebuilt whenever the contents of the source CSV change.  Run
+``python -m apps.data`` to build it ahead of time (e.g. in a release step).
+
+String dimensions are held as categoricals and numbers are downcast (see
+``SCHEMA``).  The long ``summary`` text is kept out of the main frame: it is
+wrapped for tooltips once, when the cache is built, and fetched by
+``eventid`` with ``summaries()`` when a tooltip needs it.
+
+The loaded data is held in a ``Snapshot``, together with the structures
+derived from it (indexes, rollups).  ``python -m apps.data --update delta.csv``
+merges new and changed events into the cache; running workers notice the new
+version (see ``register``), load it in a background thread, update the
+derived structures of the countries that changed and swap the snapshot in.
+A request keeps the snapshot it started with until it ends.  The files of
+the cache are stamped with the version they belong to, so a worker never
+loads the events of one update with the summaries of another, and only
+updates its structures incrementally when the version it loaded is the
+one right after its own.
+
+``TERRORISM_DATA_PATH`` may also name a directory of yearly partitions
+written by ``python -m apps.ingest``; ``TERRORISM_YEARS`` (e.g. ``2000-2016``)
+then limits the partitions that are loaded.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import textwrap
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from apps import files
+
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError:  # pragma: no cover - the cache is optional
+    pa = feather = None
+
+DATA_PATH = os.environ.get('TERRORISM_DATA_PATH',
+                           os.path.join(os.path.dirname(__file__), 'data', 'terrorism.csv'))
+CACHE_PATH = os.path.splitext(DATA_PATH)[0] + '.feather'
+YEARS = os.environ.get('TERRORISM_YEARS')
+# seconds between checks for a new dataset version, per worker (0: never)
+RELOAD_INTERVAL = float(os.environ.get('TERRORISM_RELOAD_INTERVAL', 10))
+
+# bump whenever clean() or SCHEMA change, so stale caches are rebuilt
+CACHE_VERSION = 6
+# Feather schema metadata: the version of the meta a cache file belongs to
+STAMP_KEY = b'terrorism_version'
+
+# union of the columns used by apps/world.py and apps/country.py
+SCHEMA = {
+    'eventid': 'int64',
+    'iyear': 'int16',
+    'imonth': 'int8',
+    'iday': 'int8',
+    'country_txt': 'category',
+    'provstate': 'category',
+    'city': 'category',
+    'longitude': 'float32',
+    'latitude': 'float32',
+    'nkill': 'float32',
+    'nwound': 'float32',
+    'target1': 'category',
+    'gname': 'category',
+}
+COLUMNS = list(SCHEMA)
+SUMMARY_COLUMNS = ['eventid', 'summary']
+
+_snapshot = None
+_lock = threading.Lock()
+_reloading = threading.Lock()
+_next_check = 0
+_local = threading.local()
+
+
+def read_csv(path=DATA_PATH, columns=COLUMNS):
+    return pd.read_csv(path,
+                       encoding='latin-1', low_memory=False,
+                       usecols=columns,
+                       dtype={col: SCHEMA[col] for col in columns if col in SCHEMA})
+
+
+def make_dates(years, months, days):
+    """Build ``datetime64[ns]`` dates from integer year/month/day arrays.
+
+    An unknown day (0) becomes the 15th of the month, and days past the end
+    of the month are clamped to its last day.
+    """
+    years = np.asarray(years, dtype='int64')
+    months = np.asarray(months, dtype='int64')
+    days = np.asarray(days, dtype='int64')
+
+    month_start = ((years - 1970) * 12 + months - 1).astype('datetime64[M]')
+    first_day = month_start.astype('datetime64[D]')
+    days_in_month = ((month_start + 1).astype('datetime64[D]') - first_day).astype('int64')
+    days = np.clip(np.where(days == 0, 15, days), 1, days_in_month)
+    return (first_day + (days - 1)).astype('datetime64[ns]')
+
+
+def jitter(eventids, salt=0, mean=0.04, sd=0.03):
+    """Normally distributed offsets that are a pure function of ``eventid``.
+
+    Used to spread overlapping points on the maps; unlike ``random.gauss`` the
+    result is the same on every call and in every worker, so figures built
+    from it can be cached.
+    """
+    z = np.asarray(eventids, dtype='int64').astype('uint64')
+    with np.errstate(over='ignore'):
+        # splitmix64, one stream for each of the two uniforms
+        def uniform(stream):
+            x = z + np.uint64(0x9E3779B97F4A7C15) * np.uint64(2 * salt + stream + 1)
+            x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            x = x ^ (x >> np.uint64(31))
+            return ((x >> np.uint64(11)).astype('float64') + 0.5) / float(1 << 53)
+        u1, u2 = uniform(0), uniform(1)
+    return mean + sd * np.sqrt(-2 * np.log(u1)) * np.cos(2 * np.pi * u2)
+
+
+def clean(terrorism):
+    """Drop events without a month, add ``date`` and sort by (country, date)."""
+    terrorism = terrorism[terrorism['imonth'] != 0].reset_index(drop=True)
+    terrorism['date'] = make_dates(terrorism['iyear'], terrorism['imonth'], terrorism['iday'])
+    # apps/lookup.py relies on this order
+    return terrorism.sort_values(['country_txt', 'date'], kind='mergesort').reset_index(drop=True)
+
+
+def file_hash(path, blocksize=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _meta_path(cache_path):
+    return cache_path + '.json'
+
+
+def _summary_path(cache_path):
+    return os.path.splitext(cache_path)[0] + '_summary.feather'
+
+
+def _read_meta(cache_path):
+    try:
+        with open(_meta_path(cache_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, obj):
+    with files.replacing(path) as tmp, open(tmp, 'w') as f:
+        json.dump(obj, f)
+
+
+def _source_meta(path, sha256=None):
+    stat = os.stat(path)
+    return {'version': CACHE_VERSION,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha256': sha256 or file_hash(path)}
+
+
+def cache_is_fresh(path=DATA_PATH, cache_path=CACHE_PATH):
+    """Check the cache against the source CSV.
+
+    Size and mtime are compared first; the (slower) content hash is only
+    computed when one of them differs, so a touched but unchanged CSV does
+    not force a rebuild.
+    """
+    meta = _read_meta(cache_path)
+    if (meta is None or meta.get('version') != CACHE_VERSION
+            or not os.path.exists(cache_path) or not os.path.exists(_summary_path(cache_path))):
+        return False
+    if not os.path.exists(path):
+        # only the cache was deployed
+        return True
+    stat = os.stat(path)
+    if meta['size'] == stat.st_size and meta['mtime'] == stat.st_mtime:
+        return True
+    if meta['size'] != stat.st_size:
+        return False
+    sha256 = file_hash(path)
+    if sha256 != meta['sha256']:
+        return False
+    # keep the revision of applied updates
+    _write_json(_meta_path(cache_path), dict(meta, **_source_meta(path, sha256)))
+    return True
+
+
+def _write_revision(cache_path, terrorism, summary, meta):
+    """Write the events, summaries and meta of one revision of the cache.
+
+    The three files are replaced one after the other, the meta file last;
+    the Feather files are stamped with the version of their meta, so that
+    ``read_revision`` never pairs files of different revisions.
+    """
+    for df, dest in [(terrorism, cache_path), (summary, _summary_path(cache_path))]:
+        table = pa.Table.from_pandas(df)
+        metadata = dict(table.schema.metadata or {})
+        metadata[STAMP_KEY] = _meta_version(meta).encode('utf-8')
+        table = table.replace_schema_metadata(metadata)
+        with files.replacing(dest) as tmp:
+            feather.write_feather(table, tmp)
+    _write_json(_meta_path(cache_path), meta)
+
+
+def _stamp(table):
+    return (table.schema.metadata or {}).get(STAMP_KEY, b'').decode('utf-8')
+
+
+def read_revision(cache_path=CACHE_PATH, attempts=20):
+    """Return the meta, events and summaries (Arrow tables) of one revision of the cache.
+
+    An update may replace the files while they are read: they are read again
+    until the stamps of both Feather files match the meta.
+    """
+    for attempt in range(attempts):
+        meta = _read_meta(cache_path)
+        try:
+            events = feather.read_table(cache_path, memory_map=True)
+            summary = feather.read_table(_summary_path(cache_path), memory_map=True)
+        except OSError:
+            events = summary = None
+        if meta is not None and events is not None and _stamp(events) == _stamp(summary) == _meta_version(meta):
+            return meta, events, summary
+        time.sleep(.05 * (attempt + 1))
+    raise RuntimeError('{} keeps changing while it is read'.format(cache_path))
+
+
+def build_cache(path=DATA_PATH, cache_path=CACHE_PATH):
+    """Clean the CSV and write it to ``cache_path``. Returns the frame."""
+    sha256 = file_hash(path)
+    terrorism = clean(read_csv(path, COLUMNS + ['summary']))
+
+    summary = summary_table(terrorism)
+    terrorism = terrorism.drop(columns='summary')
+    _write_revision(cache_path, terrorism, summary, _source_meta(path, sha256))
+    return terrorism
+
+
+def _concat(frames):
+    """Concatenate frames, merging (not dropping) their categories."""
+    result = {}
+    for col in frames[0].columns:
+        if frames[0][col].dtype.name == 'category':
+            result[col] = pd.api.types.union_categoricals([df[col] for df in frames],
+                                                          sort_categories=True, ignore_order=True)
+        else:
+            result[col] = np.concatenate([df[col].values for df in frames])
+    return pd.DataFrame(result)
+
+
+def apply_update(delta_path, path=DATA_PATH, cache_path=CACHE_PATH):
+    """Merge the events of the CSV ``delta_path`` into the cache.
+
+    Events whose ``eventid`` is already cached are replaced, the others are
+    added.  The meta file records the version the update applies to and the
+    countries it touched, so running workers can update their indexes and
+    rollups for those countries only.  Returns the touched countries.
+    """
+    if not cache_is_fresh(path, cache_path):
+        build_cache(path, cache_path)
+    meta, terrorism, summary = read_revision(cache_path)
+    terrorism, summary = terrorism.to_pandas(), summary.to_pandas()
+
+    delta = clean(read_csv(delta_path, COLUMNS + ['summary']))
+    delta = delta.drop_duplicates('eventid', keep='last')
+    replaced = terrorism['eventid'].isin(delta['eventid']).values
+    countries = sorted(set(terrorism['country_txt'][replaced].dropna()) |
+                       set(delta['country_txt'].dropna()))
+    terrorism = _concat([terrorism[~replaced], delta.drop(columns='summary')])
+    terrorism = terrorism.sort_values(['country_txt', 'date'], kind='mergesort').reset_index(drop=True)
+
+    summary = pd.concat([summary[~summary['eventid'].isin(delta['eventid'])], summary_table(delta)])
+    summary = summary.sort_values('eventid', kind='mergesort').reset_index(drop=True)
+
+    # the meta is written last: workers watch it
+    _write_revision(cache_path, terrorism, summary,
+                    dict(meta, revision=meta.get('revision', 0) + 1,
+                         previous=_meta_version(meta), changed=countries))
+    return countries
+
+
+def wrap_summary(text, width=40):
+    return '<br>'.join(textwrap.wrap(text, width)) if isinstance(text, str) else ''
+
+
+def summary_table(terrorism):
+    """``eventid`` and tooltip-ready ``summary``, sorted by ``eventid``."""
+    summary = terrorism[SUMMARY_COLUMNS].sort_values('eventid').reset_index(drop=True)
+    summary['summary'] = [wrap_summary(x) for x in summary['summary']]
+    return summary
+
+
+def _load_summaries(path=DATA_PATH, cache_path=CACHE_PATH):
+    """Return sorted eventids and their wrapped summaries.
+
+    With the cache the snapshot holds the summaries of its revision (see
+    ``_load_snapshot``); partitions stay in the memory-mapped Arrow column,
+    so only the rows that are actually looked up get paged in.
+    """
+    if os.path.isdir(path):
+        from apps import ingest
+        table = ingest.read_table(path, 'summary', year_range())
+        ids = table.column('eventid').to_numpy()
+        if len(ids) > 1 and (np.diff(ids) < 0).any():
+            # each partition is sorted; eventids of different years may interleave
+            order = np.argsort(ids, kind='mergesort')
+            table, ids = table.take(pa.array(order)), ids[order]
+        return ids, table.column('summary')
+    summary = summary_table(read_csv(path, SUMMARY_COLUMNS))
+    return summary['eventid'].values, summary['summary'].values
+
+
+def year_range(years=YEARS):
+    """Parse ``TERRORISM_YEARS`` ('2000-2016' or '2016') into ``[first, last]``."""
+    if not years:
+        return None
+    first, _, last = years.partition('-')
+    return [int(first), int(last or first)]
+
+
+def load(path=DATA_PATH, cache_path=CACHE_PATH):
+    if os.path.isdir(path):
+        from apps import ingest
+        return ingest.read_partitions(path, year_range())
+    if feather is None:
+        return clean(read_csv(path))
+    if not cache_is_fresh(path, cache_path):
+        build_cache(path, cache_path)
+    return read_revision(cache_path)[1].to_pandas()
+
+
+class Snapshot:
+    """One version of the dataset and the structures derived from it."""
+
+    def __init__(self, terrorism, version):
+        self.terrorism = terrorism
+        self.version = version
+        self._summaries = None
+        self._derived = {}
+        self._updaters = {}
+        self._lock = threading.Lock()
+
+    def derived(self, name, build, update=None):
+        """Return ``build(terrorism)``, computed once per snapshot.
+
+        ``update(previous, terrorism, countries)`` brings the structure of the
+        previous snapshot up to date when only ``countries`` changed.
+        """
+        if name not in self._derived:
+            with self._lock:
+                if name not in self._derived:
+                    self._derived[name] = build(self.terrorism)
+                    self._updaters[name] = (build, update)
+        return self._derived[name]
+
+    def derive_from(self, previous, countries=None):
+        """Build, ahead of use, everything ``previous`` had derived.
+
+        With ``countries`` (those whose events changed) the structures are
+        updated incrementally where they support it, else rebuilt.
+        """
+        for name, value in list(previous._derived.items()):
+            build, update = previous._updaters[name]
+            if countries is not None and update is not None:
+                value = update(value, self.terrorism, countries)
+            else:
+                value = build(self.terrorism)
+            self._derived[name] = value
+            self._updaters[name] = (build, update)
+
+    def summaries(self):
+        if self._summaries is None:
+            with self._lock:
+                if self._summaries is None:
+                    self._summaries = _load_summaries()
+        return self._summaries
+
+
+def _load_snapshot(path=DATA_PATH, cache_path=CACHE_PATH):
+    """Load the dataset on disk; return its snapshot and, with the cache, the meta of its revision."""
+    if os.path.isdir(path) or feather is None:
+        while True:
+            version = _dataset_version(path, cache_path)
+            terrorism = load(path, cache_path)
+            # partitions are replaced as a whole, by renaming their directory
+            if _dataset_version(path, cache_path) == version:
+                return Snapshot(terrorism, version), None
+    if not cache_is_fresh(path, cache_path):
+        build_cache(path, cache_path)
+    meta, events, summary = read_revision(cache_path)
+    snapshot = Snapshot(events.to_pandas(), _meta_version(meta))
+    snapshot._summaries = summary.column('eventid').to_numpy(), summary.column('summary')
+    return snapshot, meta
+
+
+def current() -> Snapshot:
+    """The snapshot of this request (see ``pinned``), else the latest one."""
+    global _snapshot
+    snapshot = getattr(_local, 'snapshot', None)
+    if snapshot is not None:
+        return snapshot
+    if _snapshot is None:
+        with _lock:
+            if _snapshot is None:
+                _snapshot = _load_snapshot()[0]
+    return _snapshot
+
+
+@contextmanager
+def pinned(snapshot=None):
+    """Keep serving ``snapshot`` (the current one) in this thread, even across a reload."""
+    previous = getattr(_local, 'snapshot', None)
+    _local.snapshot = snapshot or current()
+    try:
+        yield _local.snapshot
+    finally:
+        _local.snapshot = previous
+
+
+def peek():
+    """The snapshot this thread uses, or None if none is loaded (nothing is loaded)."""
+    return getattr(_local, 'snapshot', None) or _snapshot
+
+
+def get_terrorism() -> pd.DataFrame:
+    """Return the shared events frame, loading it on first use."""
+    return current().terrorism
+
+
+def version() -> str:
+    """Identify the loaded dataset, for keys of caches derived from it."""
+    return current().version
+
+
+def summaries(eventids) -> np.ndarray:
+    """Return the wrapped summary of each of ``eventids`` ('' where missing)."""
+    ids, values = current().summaries()
+
+    eventids = np.asarray(eventids, dtype='int64')
+    if not len(ids) or not len(eventids):
+        return np.full(len(eventids), '', dtype=object)
+    pos = np.searchsorted(ids, eventids).clip(max=len(ids) - 1)
+    if isinstance(values, np.ndarray):
+        found = values[pos]
+    else:
+        found = values.take(pa.array(pos)).to_pandas().values
+    found = found.astype(object)
+    found[(ids[pos] != eventids) | pd.isna(found)] = ''
+    return found
+
+
+def reload(path=DATA_PATH, cache_path=CACHE_PATH):
+    """Swap in the dataset on disk if its version changed; True if it did."""
+    global _snapshot
+    previous = current()
+    if _dataset_version(path, cache_path) == previous.version:
+        return False
+    snapshot, meta = _load_snapshot(path, cache_path)
+    if snapshot.version == previous.version:
+        return False
+    # the meta is the one of the loaded revision: its changes are only those
+    # since ours if it was applied right on top of it, else rebuild everything
+    countries = None
+    if meta and meta.get('previous') == previous.version:
+        countries = meta.get('changed')
+    snapshot.derive_from(previous, countries)
+    with _lock:
+        _snapshot = snapshot
+    return True
+
+
+def _reload_in_background():
+    try:
+        reload()
+    finally:
+        _reloading.release()
+
+
+def check_for_update():
+    """Start a background reload if a new version may be on disk.
+
+    Checks are at most every ``RELOAD_INTERVAL`` seconds, with jitter so the
+    workers of a server do not all reload at the same moment; requests keep
+    being served from the old snapshot meanwhile.
+    """
+    global _next_check
+    now = time.monotonic()
+    if not RELOAD_INTERVAL or _snapshot is None or now < _next_check:
+        return
+    _next_check = now + RELOAD_INTERVAL * random.uniform(.5, 1.5)
+    if _reloading.acquire(blocking=False):
+        threading.Thread(target=_reload_in_background, daemon=True).start()
+
+
+def register(server):
+    """Pin a snapshot for each request to ``server``, and pick up new versions."""
+    @server.before_request
+    def pin_snapshot():
+        check_for_update()
+        # not loaded yet (or never, with a SQL query backend): nothing to pin
+        _local.snapshot = _snapshot
+
+    @server.teardown_request
+    def unpin_snapshot(exc):
+        _local.snapshot = None
+
+
+def _dataset_version(path=DATA_PATH, cache_path=CACHE_PATH):
+    if os.path.isdir(path):
+        from apps import ingest
+        meta = dict(ingest.read_manifest(path))
+        meta['version'] = '{}-{}'.format(meta['version'], YEARS or 'all')
+        return '{version}-{size}-{sha256}'.format(**meta)
+    meta = _read_meta(cache_path) if feather is not None else None
+    if meta is None:
+        stat = os.stat(path)
+        meta = {'version': CACHE_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime}
+    return _meta_version(meta)
+
+
+def _meta_version(meta):
+    version = '{version}-{size}-{sha}'.format(sha=meta.get('sha256', meta['mtime']), **meta)
+    if meta.get('revision'):
+        version += '-r{}'.format(meta['revision'])
+    return version
+
+
+def country_names() -> list:
+    return sorted(get_terrorism()['country_txt'].unique())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the cleaned GTD cache.')
+    parser.add_argument('--source', default=DATA_PATH)
+    parser.add_argument('--cache', default=CACHE_PATH)
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild even if the cache is up to date')
+    parser.add_argument('--update', metavar='CSV',
+                        help='merge the new and changed events of this CSV into the cache')
+    args = parser.parse_args(argv)
+    if feather is None:
+        parser.error('pyarrow is required to build the cache')
+    if args.update:
+        if os.path.isdir(args.source):
+            parser.error('partitions are updated by running python -m apps.ingest again')
+        countries = apply_update(args.update, args.source, args.cache)
+        print('updated {} countries in {}'.format(len(countries), args.cache))
+    elif args.force or not cache_is_fresh(args.source, args.cache):
+        terrorism = build_cache(args.source, args.cache)
+        print('wrote {} events to {}'.format(len(terrorism), args.cache))
+    else:
+        print('{} is up to date'.format(args.cache))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""Compact encoding of the large arrays of the map figures.
+
+Plotly's JSON encoder turns numpy arrays into lists of full-precision floats
+(``33.30000305175781``) and parses and re-encodes the whole response when
+it contains a NaN.  ``array()`` rounds the values (4 decimals is about 10 m,
+well below the jitter of the maps) and turns NaN into None up front, so the
+response is shorter and encoded in a single pass.
+
+With ``TERRORISM_TYPED_ARRAYS=1`` the arrays are sent as base64 typed arrays
+(``{'dtype': 'f4', 'bdata': ...}``) straight from the numpy buffer.  Only
+plotly.js 2.28 and later read them, so this needs a newer
+dash-core-components than the pinned one.
+"""
+import base64
+import os
+
+import numpy as np
+
+TYPED_ARRAYS = os.environ.get('TERRORISM_TYPED_ARRAYS', '0') == '1'
+
+
+def typed_array(values, dtype='f4'):
+    values = np.ascontiguousarray(values, dtype='<' + dtype)
+    return {'dtype': dtype, 'bdata': base64.b64encode(values.tobytes()).decode('ascii')}
+
+
+def array(values, decimals=4):
+    """``values`` (or a scalar) for a figure, as compact as the front end allows."""
+    if np.ndim(values) == 0:
+        return values
+    values = np.asarray(values, dtype='float64')
+    if TYPED_ARRAYS:
+        return typed_array(values)
+    values = values.round(decimals)
+    missing = np.isnan(values)
+    if missing.any():
+        return np.where(missing, None, values).tolist()
+    return values.tolist()
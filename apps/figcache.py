@@ -0,0 +1,363 @@
+"""Server-side cache for the figure callbacks.
+
+The figure callbacks are pure functions of their inputs and of the loaded
+dataset, so their results are memoized:
+
+* an in-process LRU tier of at most ``TERRORISM_FIGURE_CACHE_SIZE`` figures
+  (default 256) and ``TERRORISM_FIGURE_CACHE_MB`` megabytes of JSON
+  (default 64), and
+* an optional on-disk tier in ``TERRORISM_FIGURE_CACHE_DIR``, shared by all
+  the gunicorn workers on a machine.  Once it grows past
+  ``TERRORISM_FIGURE_CACHE_DIR_MB`` megabytes (default 1024, 0 for no limit)
+  the least recently used figures are deleted.
+
+Keys include the version of the dataset, a digest of the code of the app and
+the settings that change the figures, so neither a new dataset nor a deploy
+serves old figures.
+
+Figure callbacks declared as ``siblings`` fire on the same inputs.  When one
+of them misses the cache, the others are computed at the same time on a pool
+of ``TERRORISM_PREFETCH_THREADS`` threads (default 2, 0 to turn it off).  A
+figure being computed, by a request or a prefetch, is registered as pending,
+and the requests for it meanwhile wait for it instead of computing it again.
+"""
+import functools
+import glob
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import plotly
+from plotly.utils import PlotlyJSONEncoder
+
+from apps import data, encode, files, lod, query
+
+FIGURE_CACHE_SIZE = int(os.environ.get('TERRORISM_FIGURE_CACHE_SIZE', 256))
+FIGURE_CACHE_MB = float(os.environ.get('TERRORISM_FIGURE_CACHE_MB', 64))
+FIGURE_CACHE_DIR = os.environ.get('TERRORISM_FIGURE_CACHE_DIR')
+FIGURE_CACHE_DIR_MB = float(os.environ.get('TERRORISM_FIGURE_CACHE_DIR_MB', 1024))
+PREFETCH_THREADS = int(os.environ.get('TERRORISM_PREFETCH_THREADS', 2))
+# disk writes of a process between two checks of the size of the store
+PRUNE_EVERY = 64
+
+# the undecorated figure functions by name, and the siblings of each
+figures = {}
+_siblings = {}
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def json_size(obj):
+    """Approximate length of the JSON of a figure, without encoding it.
+
+    Lists of numbers count ~10 characters per value (``encode.array``
+    rounds them), lists of strings their total length.
+    """
+    if isinstance(obj, str):
+        return len(obj) + 2
+    if isinstance(obj, Mapping):
+        return sum(len(str(k)) + 4 + json_size(v) for k, v in obj.items()) + 2
+    if isinstance(obj, (list, tuple, np.ndarray)):
+        if not len(obj):
+            return 2
+        first = obj[0]
+        if isinstance(first, str):
+            try:
+                return sum(map(len, obj)) + 3 * len(obj)
+            except TypeError:
+                pass
+        elif first is None or isinstance(first, (int, float, np.number)):
+            return 10 * len(obj)
+        return sum(json_size(v) + 1 for v in obj) + 1
+    if hasattr(obj, 'to_plotly_json'):
+        return json_size(obj.to_plotly_json())
+    return 8
+
+
+def _code_version():
+    """Digest of the sources of the app and of the plotly version, which draw the figures."""
+    sha = hashlib.sha1(plotly.__version__.encode('ascii'))
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(__file__), '*.py'))):
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+# part of every key, with the settings that change the figures
+FIGURE_FORMAT = [_code_version(), lod.MAP_POINT_BUDGET, lod.MAP_GRID_DEGREES, encode.TYPED_ARRAYS]
+
+
+class FigureCache:
+
+    def __init__(self, maxsize=FIGURE_CACHE_SIZE, directory=FIGURE_CACHE_DIR,
+                 maxbytes=FIGURE_CACHE_MB * 2 ** 20, disk_maxbytes=FIGURE_CACHE_DIR_MB * 2 ** 20):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.directory = directory
+        self.disk_maxbytes = disk_maxbytes
+        # key -> (figure, size of its JSON)
+        self._figures = OrderedDict()
+        self._bytes = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        self.disk_hits = self.disk_writes = self.disk_evictions = 0
+        self.prefetches = self.pending_hits = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key):
+        """Return the cached figure for ``key``, or None."""
+        with self._lock:
+            if key in self._figures:
+                self._figures.move_to_end(key)
+                self.hits += 1
+                return self._figures[key][0]
+        figure, size = self._read(key)
+        with self._lock:
+            if figure is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+                self._store(key, figure, size)
+        return figure
+
+    def contains(self, key):
+        """Whether the figure of ``key`` is cached, in memory or on disk."""
+        with self._lock:
+            if key in self._figures:
+                return True
+        return bool(self.directory) and os.path.exists(self._path(key))
+
+    def set(self, key, figure):
+        if not self.maxsize and not self.directory:
+            return
+        if not self.directory:
+            # Dash encodes the figure for the response; an estimate is enough here
+            with self._lock:
+                self._store(key, figure, json_size(figure))
+            return
+        text = json.dumps(figure, cls=PlotlyJSONEncoder)
+        with self._lock:
+            self._store(key, figure, len(text))
+        self._write(key, text)
+
+    def claim(self, key):
+        """Return ``(future, owner)`` for the figure of ``key``.
+
+        The first caller owns the future and must ``fulfil`` it; the others,
+        until it is fulfilled, get the same future and ``wait`` for it.
+        """
+        with self._lock:
+            if key in self._figures:
+                future = Future()
+                future.set_result(self._figures[key][0])
+                return future, False
+            if key in self._pending:
+                return self._pending[key], False
+            future = self._pending[key] = Future()
+            return future, True
+
+    def fulfil(self, key, future, compute):
+        """Compute (or read from disk) the figure of the claimed ``future``, store and return it."""
+        try:
+            figure = self._read(key)[0]
+            if figure is None:
+                figure = compute()
+                self.set(key, figure)
+            future.set_result(figure)
+            return figure
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def wait(self, future):
+        """The figure of a ``future`` owned by another caller, or None if it failed."""
+        try:
+            figure = future.result()
+        except Exception:
+            return None
+        with self._lock:
+            self.pending_hits += 1
+        return figure
+
+    def prefetch(self, key, compute):
+        """Compute the figure of ``key`` in the background, unless it is known or pending."""
+        future, owner = self.claim(key)
+        if not owner:
+            return
+        with self._lock:
+            self.prefetches += 1
+
+        def run():
+            try:
+                self.fulfil(key, future, compute)
+            except Exception:
+                # the request that needs it computes it again
+                pass
+        _executor().submit(run)
+
+    def _store(self, key, figure, size):
+        if key in self._figures:
+            self._bytes -= self._figures[key][1]
+        self._figures[key] = (figure, size)
+        self._figures.move_to_end(key)
+        self._bytes += size
+        while self._figures and (len(self._figures) > self.maxsize or self._bytes > self.maxbytes):
+            self._bytes -= self._figures.popitem(last=False)[1][1]
+            self.evictions += 1
+
+    def _read(self, key):
+        """The figure of ``key`` in the store and the size of its JSON, or (None, 0)."""
+        if not self.directory:
+            return None, 0
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                text = f.read()
+            figure = json.loads(text)
+        except (OSError, ValueError):
+            return None, 0
+        try:
+            # recently used, for prune()
+            os.utime(path)
+        except OSError:
+            pass
+        return figure, len(text)
+
+    def _write(self, key, text):
+        if not self.directory:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with files.replacing(path) as tmp, open(tmp, 'w') as f:
+            f.write(text)
+        with self._lock:
+            self.disk_writes += 1
+            prune = self.disk_maxbytes and self.disk_writes % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Delete the least recently used figures of the store beyond ``disk_maxbytes``.
+
+        The store is cut down to 90% of the limit, so that it is not pruned
+        again a few writes later.  Other processes may prune at the same time.
+        """
+        files = []
+        for directory in os.scandir(self.directory):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.endswith('.json'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        if total <= self.disk_maxbytes:
+            return
+        deleted = 0
+        for _, size, path in sorted(files):
+            if total <= 0.9 * self.disk_maxbytes:
+                break
+            try:
+                os.remove(path)
+                deleted += 1
+            except OSError:
+                pass
+            total -= size
+        with self._lock:
+            self.disk_evictions += deleted
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._figures), 'maxsize': self.maxsize,
+                    'bytes': self._bytes, 'maxbytes': self.maxbytes,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'disk_hits': self.disk_hits, 'disk_writes': self.disk_writes,
+                    'disk_evictions': self.disk_evictions,
+                    'pending': len(self._pending),
+                    'prefetches': self.prefetches, 'pending_hits': self.pending_hits}
+
+
+cache = FigureCache()
+
+
+def make_key(func, args, kwargs):
+    payload = json.dumps([FIGURE_FORMAT, func.__module__, func.__name__, query.get_backend().version(),
+                          args, kwargs], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _executor():
+    # created in each worker, after the fork
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(PREFETCH_THREADS, thread_name_prefix='prefetch')
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def siblings(*names):
+    """Declare figure callbacks with the same inputs; a miss on one prefetches the others."""
+    for name in names:
+        _siblings[name] = [n for n in names if n != name]
+
+
+def prefetch(func, args, kwargs):
+    key = make_key(func, args, kwargs)
+    # computed with the snapshot of the request that asked for it
+    snapshot = data.peek()
+
+    def compute():
+        if snapshot is None:
+            return func(*args, **kwargs)
+        with data.pinned(snapshot):
+            return func(*args, **kwargs)
+    cache.prefetch(key, compute)
+
+
+def cached_figure(func):
+    """Memoize a figure callback in ``cache``."""
+    figures[func.__name__] = func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = make_key(func, args, kwargs)
+        figure = cache.get(key)
+        if figure is not None:
+            return figure
+        # registered before computing, so that siblings wait for it instead of prefetching it
+        future, owner = cache.claim(key)
+        if not owner:
+            figure = cache.wait(future)
+            if figure is not None:
+                return figure
+            figure = func(*args, **kwargs)
+            cache.set(key, figure)
+            return figure
+        if PREFETCH_THREADS and (cache.maxsize or cache.directory):
+            for name in _siblings.get(func.__name__, ()):
+                prefetch(figures[name], args, kwargs)
+        return cache.fulfil(key, future, lambda: func(*args, **kwargs))
+    return wrapper
@@ -0,0 +1,38 @@
+"""Atomic replacement of the files the workers read.
+
+Caches, partitions, databases and stored figures are written under a
+temporary name next to their destination and moved over it in one
+``os.replace``, so readers see either the old file or the new one.  The
+temporary name is unique per process and thread: workers building the
+same cache at once, or the prefetch pool and the request threads of one
+worker, never write into each other's file.
+"""
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+
+def temp_path(path, suffix='tmp'):
+    """A name next to ``path``, unique to this process and thread."""
+    return '{}.{}-{}.{}'.format(path.rstrip(os.sep), os.getpid(), threading.get_ident(), suffix)
+
+
+def remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+@contextmanager
+def replacing(path):
+    """Yield a temporary path to write; it replaces ``path`` if the block succeeds."""
+    tmp = temp_path(path)
+    remove(tmp)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    except BaseException:
+        remove(tmp)
+        raise
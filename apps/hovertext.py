@@ -0,0 +1,68 @@
+"""Tooltips for the map traces.
+
+The date label of every day is formatted once, and event summaries are
+wrapped once when the data cache is built (see ``data.summary_table``).
+``build()`` then assembles the tooltips of a selection with array gathers
+and element-wise concatenation instead of formatting row by row.
+"""
+import numpy as np
+import pandas as pd
+
+from apps import query
+
+DATE_FORMAT = '%d %b, %Y'
+
+_date_labels = None
+
+
+class DateLabels:
+
+    def __init__(self, first_day, last_day):
+        self.first_day = np.datetime64(first_day, 'D')
+        self.last_day = np.datetime64(last_day, 'D')
+        days = pd.date_range(self.first_day, self.last_day, freq='D')
+        self.labels = np.asarray(days.strftime(DATE_FORMAT), dtype=object)
+
+    def covers(self, first_day, last_day):
+        return self.first_day <= first_day and last_day <= self.last_day
+
+    def __call__(self, dates):
+        days = (np.asarray(dates, dtype='datetime64[D]') - self.first_day).astype('int64')
+        return self.labels[days]
+
+
+def date_labels(dates) -> np.ndarray:
+    """The label of each of ``dates``; the table of labels grows to cover them."""
+    global _date_labels
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    first, last = dates.min(), dates.max()
+    labels = _date_labels
+    if labels is None or not labels.covers(first, last):
+        if labels is not None:
+            first, last = min(first, labels.first_day), max(last, labels.last_day)
+        # whole years, so that the table rarely needs to grow
+        labels = _date_labels = DateLabels(first.astype('datetime64[Y]'),
+                                           (last.astype('datetime64[Y]') + 1).astype('datetime64[D]') - 1)
+    return labels(dates)
+
+
+def _text(values):
+    """``str()`` of each value, formatting every distinct value only once."""
+    codes, uniques = pd.factorize(values)
+    labels = np.array([str(u) for u in uniques] + ['nan'], dtype=object)
+    return labels[codes]
+
+
+def build(df, rows=None) -> np.ndarray:
+    """Return the tooltip of every event (row) of ``df``, or of the positions ``rows``."""
+    if rows is not None:
+        df = df.iloc[rows]
+    if not len(df):
+        return np.array([], dtype=object)
+    return (_text(df['city']) + ', ' + _text(df['country_txt']) + '<br>' +
+            date_labels(df['date'].values) + '<br>' +
+            'Perpetrator: ' + _text(df['gname']) + '<br>' +
+            'Target: ' + _text(df['target1']) + '<br>' +
+            'Deaths: ' + _text(df['nkill']) + '<br>' +
+            'Injured: ' + _text(df['nwound']) + '<br><br>' +
+            query.get_backend().summaries(df['eventid']))
@@ -0,0 +1,178 @@
+"""Chunked ingestion of GTD releases that do not fit in memory.
+
+The CSV is read ``chunksize`` rows at a time.  Each chunk gets the same
+cleaning as ``data.clean`` and is appended to one Arrow IPC file per year,
+so peak memory is bounded by the chunk size (and, when the summaries are
+sorted at the end, by the largest year):
+
+    <directory>/events/iyear=1970.arrow     events without their summary
+    <directory>/summary/iyear=1970.arrow    eventid + wrapped summary, by eventid
+    <directory>/manifest.json               source metadata, rows per year
+
+Point ``TERRORISM_DATA_PATH`` at the directory to serve it.  The partitions
+are memory-mapped, and ``read_partitions`` reads only the years asked for
+(``TERRORISM_YEARS=2000-2016`` limits what the dashboard loads).
+
+    python -m apps.ingest gtd.csv apps/data/terrorism
+"""
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from apps import data, files
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - partitions need pyarrow
+    pa = None
+
+CHUNKSIZE = 200000
+MANIFEST = 'manifest.json'
+
+# the string dimensions are plain strings on disk, every chunk has its own categories
+CHUNK_DTYPES = {col: dtype for col, dtype in data.SCHEMA.items() if dtype != 'category'}
+
+
+def arrow_schema():
+    types = {'int64': pa.int64(), 'int16': pa.int16(), 'int8': pa.int8(),
+             'float32': pa.float32(), 'category': pa.string()}
+    return pa.schema([(col, types[dtype]) for col, dtype in data.SCHEMA.items()] +
+                     [('date', pa.timestamp('ns'))])
+
+
+SUMMARY_SCHEMA = None if pa is None else pa.schema([('eventid', pa.int64()), ('summary', pa.string())])
+
+
+def _partition(directory, kind, year):
+    return os.path.join(directory, kind, 'iyear={}.arrow'.format(year))
+
+
+def read_chunks(path, chunksize=CHUNKSIZE):
+    """Yield the cleaned chunks of the CSV at ``path``."""
+    chunks = pd.read_csv(path, encoding='latin-1', usecols=data.COLUMNS + ['summary'],
+                         dtype=CHUNK_DTYPES, chunksize=chunksize)
+    for chunk in chunks:
+        yield data.clean(chunk)
+
+
+class _PartitionWriter:
+
+    def __init__(self, directory, kind, schema):
+        self.directory, self.kind, self.schema = directory, kind, schema
+        self.writers = {}
+        os.makedirs(os.path.join(directory, kind))
+
+    def write(self, year, df):
+        if year not in self.writers:
+            sink = pa.OSFile(_partition(self.directory, self.kind, year), 'wb')
+            self.writers[year] = (sink, pa.ipc.new_file(sink, self.schema))
+        table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        self.writers[year][1].write_table(table)
+
+    def close(self):
+        for sink, writer in self.writers.values():
+            writer.close()
+            sink.close()
+
+
+def _sort_summaries(directory, year):
+    path = _partition(directory, 'summary', year)
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    order = np.argsort(table.column('eventid').to_numpy(), kind='mergesort')
+    table = table.take(pa.array(order))
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, SUMMARY_SCHEMA) as writer:
+        writer.write_table(table)
+
+
+def ingest(path, directory, chunksize=CHUNKSIZE):
+    """Write the partitions of the CSV at ``path`` to ``directory``."""
+    tmp = files.temp_path(directory)
+    files.remove(tmp)
+    try:
+        events = _PartitionWriter(tmp, 'events', arrow_schema())
+        summary = _PartitionWriter(tmp, 'summary', SUMMARY_SCHEMA)
+        rows = {}
+        try:
+            for chunk in read_chunks(path, chunksize):
+                chunk['summary'] = [data.wrap_summary(x) for x in chunk['summary']]
+                for year, df in chunk.groupby('iyear', sort=False):
+                    year = int(year)
+                    events.write(year, df.drop(columns='summary'))
+                    summary.write(year, df[data.SUMMARY_COLUMNS])
+                    rows[year] = rows.get(year, 0) + len(df)
+        finally:
+            events.close()
+            summary.close()
+        for year in rows:
+            _sort_summaries(tmp, year)
+
+        manifest = dict(data._source_meta(path), rows={str(y): n for y, n in sorted(rows.items())})
+        with open(os.path.join(tmp, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+    except BaseException:
+        files.remove(tmp)
+        raise
+
+    old = None
+    if os.path.exists(directory):
+        old = files.temp_path(directory, 'old')
+        os.rename(directory, old)
+    os.rename(tmp, directory)
+    if old:
+        files.remove(old)
+    return manifest
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)
+
+
+def partition_years(directory, kind='events'):
+    paths = glob.glob(os.path.join(directory, kind, 'iyear=*.arrow'))
+    return sorted(int(os.path.basename(p)[len('iyear='):-len('.arrow')]) for p in paths)
+
+
+def read_table(directory, kind='events', years=None):
+    """Memory-map the partitions of ``years`` (all by default) as one table."""
+    tables = []
+    for year in partition_years(directory, kind):
+        if years is None or years[0] <= year <= years[1]:
+            source = pa.memory_map(_partition(directory, kind, year))
+            tables.append(pa.ipc.open_file(source).read_all())
+    if not tables:
+        schema = arrow_schema() if kind == 'events' else SUMMARY_SCHEMA
+        return schema.empty_table()
+    return pa.concat_tables(tables)
+
+
+def read_partitions(directory, years=None):
+    """The events frame, as ``data.load`` returns it, for ``years``."""
+    terrorism = read_table(directory, 'events', years).to_pandas(strings_to_categorical=True)
+    for col, dtype in data.SCHEMA.items():
+        if dtype == 'category':
+            # categories come in order of appearance; read_csv sorts them
+            terrorism[col] = terrorism[col].cat.reorder_categories(sorted(terrorism[col].cat.categories))
+    return terrorism.sort_values(['country_txt', 'date'], kind='mergesort').reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ingest a GTD CSV into yearly partitions.')
+    parser.add_argument('source')
+    parser.add_argument('directory')
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    args = parser.parse_args(argv)
+    if pa is None:
+        parser.error('pyarrow is required to write partitions')
+    manifest = ingest(args.source, args.directory, args.chunksize)
+    print('wrote {:,} events in {} yearly partitions to {}'.format(
+        sum(manifest['rows'].values()), len(manifest['rows']), args.directory))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Level of detail for the maps.
+
+A figure with more than ``TERRORISM_MAP_POINT_BUDGET`` points (default 5000)
+is not sent point by point.  Its events are binned into a grid of
+``TERRORISM_MAP_GRID_DEGREES`` degree cells (default 0.5, doubled until the
+figure fits the budget) and each cell is drawn as one marker, sized by its
+number of attacks, with the attack and death totals and a sample tooltip.
+Below the budget the raw points are sent unchanged.
+
+Tooltips are only built for the rows that are sent: every point below the
+budget, the sample of each cell above it.
+"""
+import os
+from collections import namedtuple
+
+import numpy as np
+
+MAP_POINT_BUDGET = int(os.environ.get('TERRORISM_MAP_POINT_BUDGET', 5000))
+MAP_GRID_DEGREES = float(os.environ.get('TERRORISM_MAP_GRID_DEGREES', 0.5))
+
+Trace = namedtuple('Trace', ['name', 'lon', 'lat', 'hovertext', 'size'])
+
+
+def _cell_keys(lon, lat, cell):
+    columns = int(np.ceil(180 / cell)) + 1
+    with np.errstate(invalid='ignore'):
+        x = np.floor((lon + 180) / cell)
+        y = np.floor((lat + 90) / cell)
+    return np.where(np.isfinite(x) & np.isfinite(y), x * columns + y, -1).astype('int64')
+
+
+def _tooltips(tooltips, row_lists):
+    """``tooltips()`` of each of ``row_lists``, built once for the rows they share."""
+    if not row_lists:
+        return []
+    rows = np.unique(np.concatenate(row_lists)).astype('int64')
+    text = tooltips(rows)
+    return [text[np.searchsorted(rows, r)] for r in row_lists]
+
+
+def _bin(name, rows, keys, lon, lat, nkill):
+    """The cells of ``rows`` as a ``Trace`` with the header of their tooltips, and their sample rows."""
+    rows = rows[keys[rows] >= 0]
+    cells, first, inverse, counts = np.unique(keys[rows], return_index=True,
+                                              return_inverse=True, return_counts=True)
+    deaths = np.bincount(inverse, weights=np.nan_to_num(nkill[rows].astype('float64')))
+    headers = ['Attacks: {:,}<br>Deaths: {:,.0f}<br><br>'.format(n, d) for n, d in zip(counts, deaths)]
+    return Trace(name,
+                 np.bincount(inverse, weights=lon[rows]) / counts,
+                 np.bincount(inverse, weights=lat[rows]) / counts,
+                 np.array(headers, dtype=object),
+                 np.clip(6 + 3 * np.log2(counts), 6, 40)), rows[first]
+
+
+def level_of_detail(lon, lat, nkill, tooltips, groups, size=9,
+                    budget=MAP_POINT_BUDGET, cell=MAP_GRID_DEGREES):
+    """Return a ``Trace`` for each ``(name, rows)`` pair of ``groups``.
+
+    ``lon``, ``lat`` and ``nkill`` are aligned arrays and ``rows`` index into
+    them; ``tooltips(rows)`` returns the tooltips of the given rows.  Traces
+    are raw points with marker ``size`` while the figure fits the point
+    ``budget``, and grid cells otherwise.
+    """
+    groups = list(groups)
+    if sum(len(rows) for _, rows in groups) <= budget:
+        hover = _tooltips(tooltips, [rows for _, rows in groups])
+        return [Trace(name, lon[rows], lat[rows], text, size) for (name, rows), text in zip(groups, hover)]
+
+    everything = np.unique(np.concatenate([rows for _, rows in groups]))
+    keys = _cell_keys(lon, lat, cell)
+    while len(np.unique(keys[everything])) > budget:
+        cell *= 2
+        keys = _cell_keys(lon, lat, cell)
+    binned = [_bin(name, rows, keys, lon, lat, nkill) for name, rows in groups]
+    samples = _tooltips(tooltips, [first for _, first in binned])
+    return [trace._replace(hovertext=trace.hovertext + text) for (trace, _), text in zip(binned, samples)]
@@ -0,0 +1,92 @@
+"""Multi-key index over the events frame for the country page.
+
+The frame is sorted by (country, date) when it is cleaned, so each country
+is a contiguous block of rows found through an offset table.  Within a
+country, every provstate, city and gname value has a posting list of the
+(date-ordered) rows it appears in, and date ranges are resolved with a
+binary search.  Lookups therefore cost in proportion to the rows they
+return, not to the size of the dataset.
+
+Posting lists hold positions relative to the start of their country, so
+after a data update only the countries that changed need new ones.
+"""
+import numpy as np
+
+from apps import data
+
+POSTING_COLUMNS = ['provstate', 'city', 'gname']
+
+
+def _postings(codes, categories):
+    """Map each value to the (sorted) positions where ``codes`` has it."""
+    order = np.argsort(codes, kind='mergesort').astype('int32')
+    sorted_codes = codes[order]
+    splits = np.flatnonzero(np.diff(sorted_codes)) + 1
+    return {categories[group_codes[0]]: positions
+            for positions, group_codes in zip(np.split(order, splits), np.split(sorted_codes, splits))
+            if len(positions) and group_codes[0] >= 0}
+
+
+class EventIndex:
+
+    def __init__(self, terrorism, previous=None, countries=()):
+        self.terrorism = terrorism
+        self.dates = terrorism['date'].values
+
+        country = terrorism['country_txt'].cat
+        codes = country.codes.values
+        if len(codes) and (np.diff(codes) < 0).any():
+            raise ValueError('the events frame must be sorted by country_txt')
+        bounds = np.searchsorted(codes, np.arange(len(country.categories) + 1))
+        self.offsets = {c: (bounds[i], bounds[i + 1])
+                        for i, c in enumerate(country.categories)
+                        if bounds[i + 1] > bounds[i]}
+
+        self.postings = {}
+        for c, (start, stop) in self.offsets.items():
+            if previous is not None and c not in countries and c in previous.postings:
+                self.postings[c] = previous.postings[c]
+                continue
+            self.postings[c] = {col: _postings(terrorism[col].cat.codes.values[start:stop],
+                                               terrorism[col].cat.categories)
+                                for col in POSTING_COLUMNS}
+
+    def updated(self, terrorism, countries):
+        """The index of ``terrorism``, where only ``countries`` changed since this one."""
+        return EventIndex(terrorism, self, set(countries))
+
+    def values(self, country, column):
+        """Distinct values of ``column`` for ``country``, sorted."""
+        return sorted(self.postings.get(country, {}).get(column, {}))
+
+    def rows(self, country, start=None, end=None, **selections):
+        """Row positions of the events of ``country`` in date order.
+
+        ``start`` and ``end`` bound the dates inclusively.  Keyword arguments
+        such as ``provstate=[...]`` or ``city=[...]`` keep only the events
+        matching any of the listed values.
+        """
+        if country not in self.offsets:
+            return np.array([], dtype='int64')
+        offset, stop = self.offsets[country]
+        if selections:
+            postings = self.postings[country]
+            local = [postings[col][value]
+                     for col, values in selections.items()
+                     for value in values if value in postings[col]]
+            local = np.unique(np.concatenate(local)) if local else np.array([], dtype='int32')
+        else:
+            local = np.arange(stop - offset)
+
+        dates = self.dates[offset + local] if selections else self.dates[offset:stop]
+        lo = 0 if start is None else np.searchsorted(dates, np.datetime64(start, 'ns'), side='left')
+        hi = len(dates) if end is None else np.searchsorted(dates, np.datetime64(end, 'ns'), side='right')
+        return offset + local[lo:hi].astype('int64')
+
+    def events(self, country, start=None, end=None, **selections):
+        """The ``rows()`` of the events frame, as a frame."""
+        return self.terrorism.iloc[self.rows(country, start, end, **selections)]
+
+
+def get_index() -> EventIndex:
+    return data.current().derived('index', EventIndex, EventIndex.updated)
@@ -0,0 +1,36 @@
+"""Shared and private memory of the current process (Linux).
+
+With the data preloaded in the gunicorn master (see ``gunicorn.conf.py``),
+the workers share its pages until they write to them.  ``usage()`` reads
+``/proc/self/smaps_rollup`` (or sums ``/proc/self/smaps`` on older kernels)
+to show how much of a worker is still shared.
+"""
+import os
+
+FIELDS = {'Rss': 'rss', 'Pss': 'pss',
+          'Shared_Clean': 'shared', 'Shared_Dirty': 'shared',
+          'Private_Clean': 'private', 'Private_Dirty': 'private'}
+
+
+def usage(pid='self'):
+    """Return the rss, pss, shared and private bytes of ``pid``, or {} without /proc."""
+    for name in ['smaps_rollup', 'smaps']:
+        path = os.path.join('/proc', str(pid), name)
+        if os.path.exists(path):
+            break
+    else:
+        return {}
+    result = dict.fromkeys(set(FIELDS.values()), 0)
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in FIELDS:
+                result[FIELDS[key]] += int(value.split()[0]) * 1024
+    return result
+
+
+def report(pid='self'):
+    mb = {k: v / 2 ** 20 for k, v in usage(pid).items()}
+    if not mb:
+        return 'memory usage not available'
+    return 'rss {rss:.0f} MB: {shared:.0f} MB shared, {private:.0f} MB private (pss {pss:.0f} MB)'.format(**mb)
@@ -0,0 +1,198 @@
+"""Latency and payload instrumentation for the Dash callbacks.
+
+Every ``@instrumented`` callback records, per call:
+
+* its wall time, and the time spent in named phases (``with phase('filter')``
+  inside the callback),
+* the size of its JSON response and the time Dash took to encode it
+  (``serialize``), taken from the Flask response when it is served,
+* the cardinality of its inputs: the number of values selected in a
+  dropdown, or the width of a slider range.
+
+The histograms are served by ``/metrics`` on the Flask server, in the
+Prometheus text format (``/metrics?format=json`` for JSON).  Set
+``TERRORISM_METRICS=0`` to turn recording off.  The shared and private
+memory of the worker (see ``apps.memory``) are reported alongside.
+
+Setting ``TERRORISM_PROFILE_RATE`` to a fraction between 0 and 1 runs that
+share of calls under cProfile and dumps the stats to ``TERRORISM_PROFILE_DIR``
+(default: the temp directory), one ``.prof`` file per call.
+"""
+import cProfile
+import functools
+import inspect
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import flask
+
+from apps import figcache, memory
+
+METRICS_ENABLED = os.environ.get('TERRORISM_METRICS', '1') != '0'
+PROFILE_RATE = float(os.environ.get('TERRORISM_PROFILE_RATE', 0))
+PROFILE_DIR = os.environ.get('TERRORISM_PROFILE_DIR', tempfile.gettempdir())
+
+SECONDS_BUCKETS = [.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10]
+BYTES_BUCKETS = [2 ** i for i in range(8, 28, 2)]
+CARDINALITY_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 600]
+
+_local = threading.local()
+_lock = threading.Lock()
+histograms = {}
+# instrumented callbacks by name, for tools that drive them directly
+callbacks = {}
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        cumulative, total = [], 0
+        for n in self.counts:
+            total += n
+            cumulative.append(total)
+        return {'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], cumulative)),
+                'count': self.count, 'sum': self.sum}
+
+
+def observe(name, labels, value, buckets):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        if key not in histograms:
+            histograms[key] = Histogram(buckets)
+        histograms[key].observe(value)
+
+
+@contextmanager
+def phase(name):
+    """Time a phase of the callback being instrumented."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases = getattr(_local, 'phases', None)
+        if phases is not None:
+            phases[name] = phases.get(name, 0) + time.perf_counter() - start
+
+
+def cardinalities(arguments):
+    """Number of selected values of list inputs, width of range inputs."""
+    result = {}
+    for name, value in arguments.items():
+        if (isinstance(value, (list, tuple)) and len(value) == 2
+                and all(isinstance(v, (int, float)) for v in value)):
+            result[name + '_width'] = value[1] - value[0]
+        elif isinstance(value, (list, tuple)):
+            result[name + '_count'] = len([v for v in value if v not in ('', None)])
+    return result
+
+
+def _profiled(func, name, args, kwargs):
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func, *args, **kwargs)
+    finally:
+        filename = '{}-{}-{}.prof'.format(name, int(time.time() * 1000), os.getpid())
+        profile.dump_stats(os.path.join(PROFILE_DIR, filename))
+
+
+def instrumented(func):
+    """Record latency, phases, payload size and input cardinality of ``func``."""
+    name = func.__name__
+    parameters = list(inspect.signature(func).parameters)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not METRICS_ENABLED:
+            return func(*args, **kwargs)
+        labels = {'callback': name}
+        _local.phases = {}
+        start = time.perf_counter()
+        try:
+            if PROFILE_RATE and random.random() < PROFILE_RATE:
+                result = _profiled(func, name, args, kwargs)
+            else:
+                result = func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            phases, _local.phases = _local.phases, None
+
+        observe('callback_seconds', labels, elapsed, SECONDS_BUCKETS)
+        for phase_name, seconds in phases.items():
+            observe('callback_phase_seconds', dict(labels, phase=phase_name), seconds, SECONDS_BUCKETS)
+        arguments = dict(zip(parameters, args), **kwargs)
+        for input_name, value in cardinalities(arguments).items():
+            observe('callback_input_cardinality', dict(labels, input=input_name), value, CARDINALITY_BUCKETS)
+        if flask.has_request_context():
+            # the response is measured once Dash has encoded it (see register)
+            flask.g.metrics_callback = name
+            flask.g.metrics_returned = time.perf_counter()
+        return result
+    callbacks[name] = wrapper
+    return wrapper
+
+
+def snapshot():
+    with _lock:
+        return [{'name': name, 'labels': dict(labels), **h.to_dict()}
+                for (name, labels), h in sorted(histograms.items())]
+
+
+def _prometheus(metrics, cache_stats, memory_usage):
+    def label_text(labels):
+        return ','.join('{}="{}"'.format(k, v) for k, v in sorted(labels.items()))
+
+    lines = []
+    for m in metrics:
+        for le, n in m['buckets'].items():
+            lines.append('terrorism_{}_bucket{{{}}} {}'.format(m['name'], label_text(dict(m['labels'], le=le)), n))
+        lines.append('terrorism_{}_count{{{}}} {}'.format(m['name'], label_text(m['labels']), m['count']))
+        lines.append('terrorism_{}_sum{{{}}} {}'.format(m['name'], label_text(m['labels']), m['sum']))
+    for stat, value in sorted(cache_stats.items()):
+        lines.append('terrorism_figure_cache_{} {}'.format(stat, value))
+    for kind, value in sorted(memory_usage.items()):
+        lines.append('terrorism_memory_{}_bytes {}'.format(kind, value))
+    return '\n'.join(lines) + '\n'
+
+
+def register(server):
+    """Serve the metrics of this worker at ``/metrics`` on ``server``.
+
+    Also records the response size and encoding time of the instrumented
+    callbacks; register it after ``Compress(server)`` so that the hooks see
+    the JSON before it is compressed.
+    """
+    @server.after_request
+    def record_response(response):
+        name = flask.g.pop('metrics_callback', None)
+        if name is not None and not response.direct_passthrough:
+            labels = {'callback': name}
+            observe('callback_phase_seconds', dict(labels, phase='serialize'),
+                    time.perf_counter() - flask.g.metrics_returned, SECONDS_BUCKETS)
+            observe('callback_response_bytes', labels, len(response.get_data()), BYTES_BUCKETS)
+        return response
+
+    @server.route('/metrics')
+    def metrics_endpoint():
+        metrics, cache_stats, memory_usage = snapshot(), figcache.cache.stats(), memory.usage()
+        if flask.request.args.get('format') == 'json':
+            return flask.jsonify({'pid': os.getpid(), 'callbacks': metrics, 'figure_cache': cache_stats,
+                                  'memory': memory_usage})
+        return flask.Response(_prometheus(metrics, cache_stats, memory_usage), mimetype='text/plain')
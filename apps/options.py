@@ -0,0 +1,107 @@
+"""Dropdown options, computed once per dataset version.
+
+The option lists of every country (provinces, cities, perpetrators) are
+built on first use and then served from a dictionary, so switching country
+is a lookup.  ``/api/options/<column>?q=...&country=...`` searches the long
+lists server-side, for type-ahead inputs:
+
+    GET /api/options/city?country=Iraq&q=bag&limit=20
+"""
+import threading
+
+import flask
+
+from apps import query
+
+COLUMNS = ['provstate', 'city', 'gname']
+SEARCH_LIMIT = 50
+
+_table = None
+_lock = threading.Lock()
+
+
+class OptionTable:
+
+    def __init__(self, backend):
+        self.version = backend.version()
+        self.countries = backend.countries()
+        self.country_options = _options(self.countries)
+        self.values = {country: {column: backend.values(country, column) for column in COLUMNS}
+                       for country in self.countries}
+        self.options = {country: {column: _options(values) for column, values in columns.items()}
+                        for country, columns in self.values.items()}
+        # all countries together, for searches without one
+        self.all_values = {column: sorted({v for columns in self.values.values() for v in columns[column]})
+                           for column in COLUMNS}
+
+    def search(self, column, q='', country=None, limit=SEARCH_LIMIT):
+        """Values of ``column`` containing ``q`` (any case), those starting with it first."""
+        if column == 'country_txt':
+            values = self.countries
+        elif country:
+            values = self.values.get(country, {}).get(column, [])
+        else:
+            values = self.all_values.get(column, [])
+        q = q.lower()
+        starts, contains = [], []
+        for value in values:
+            i = value.lower().find(q)
+            if i == 0:
+                starts.append(value)
+            elif i > 0:
+                contains.append(value)
+        return (starts + contains)[:limit]
+
+
+def _options(values):
+    return [{'label': v, 'value': v} for v in values]
+
+
+def get_table() -> OptionTable:
+    """The option table of the current dataset version, built on first use."""
+    global _table
+    version = query.get_backend().version()
+    if _table is None or _table.version != version:
+        with _lock:
+            if _table is None or _table.version != version:
+                _table = OptionTable(query.get_backend())
+    return _table
+
+
+def lazy_layout(build_layout):
+    """A ``get_layout`` for a page: ``build_layout()``, built on the first visit (again after a data update).
+
+    The layouts hold the dropdown options, hence the rebuild with each dataset version.
+    """
+    layout = None
+    lock = threading.Lock()
+
+    def get_layout():
+        nonlocal layout
+        version = query.get_backend().version()
+        if layout is None or layout[0] != version:
+            with lock:
+                if layout is None or layout[0] != version:
+                    layout = version, build_layout()
+        return layout[1]
+    return get_layout
+
+
+def countries():
+    return get_table().country_options
+
+
+def options(country, column):
+    return get_table().options.get(country, {}).get(column, [])
+
+
+def register(server):
+    """Serve the type-ahead search at ``/api/options/<column>`` on ``server``."""
+    @server.route('/api/options/<column>')
+    def search_options(column):
+        if column not in COLUMNS + ['country_txt']:
+            flask.abort(404)
+        args = flask.request.args
+        limit = min(max(args.get('limit', SEARCH_LIMIT, type=int), 1), 1000)
+        values = get_table().search(column, args.get('q', ''), args.get('country'), limit)
+        return flask.jsonify(_options(values))
@@ -0,0 +1,338 @@
+"""Query backends for the page callbacks.
+
+The callbacks ask a backend for the events and aggregates they draw, never
+for the frame itself:
+
+* ``pandas`` (default) answers from the shared in-memory snapshot, its event
+  index and its (country x year) cube;
+* ``sqlite`` and ``duckdb`` answer with parameterized queries against one
+  on-disk database, opened read-only by every worker, so the workers do not
+  each hold a copy of the events.
+
+Pick one with ``TERRORISM_QUERY_BACKEND``.  Build the database (again after
+each data update) with
+
+    python -m apps.query --engine sqlite
+
+It is written to ``TERRORISM_QUERY_DB`` (default: next to the CSV).  Without
+the database, or without the ``duckdb`` package, the pandas backend is used.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from apps import data, files, lookup, rollups
+
+try:
+    import duckdb
+except ImportError:  # pragma: no cover - duckdb is optional
+    duckdb = None
+
+QUERY_BACKEND = os.environ.get('TERRORISM_QUERY_BACKEND', 'pandas')
+QUERY_DB = os.environ.get('TERRORISM_QUERY_DB')
+
+EVENT_COLUMNS = ['eventid', 'iyear', 'date', 'country_txt', 'provstate', 'city',
+                 'longitude', 'latitude', 'nkill', 'nwound', 'target1', 'gname']
+MEASURES = {'counts': 'COUNT(*)', 'deaths': 'COALESCE(SUM(nkill), 0)', 'wounds': 'COALESCE(SUM(nwound), 0)'}
+EPOCH = np.datetime64('1970-01-01', 'D')
+
+# ``row`` is the position in the cleaned frame, sorted by (country, date)
+SCHEMA_SQL = [
+    '''CREATE TABLE events (row INTEGER PRIMARY KEY, eventid BIGINT, iyear INTEGER, date INTEGER,
+                           country_txt TEXT, provstate TEXT, city TEXT, longitude REAL, latitude REAL,
+                           nkill REAL, nwound REAL, target1 TEXT, gname TEXT)''',
+    'CREATE TABLE summaries (eventid BIGINT PRIMARY KEY, summary TEXT)',
+    'CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)',
+]
+INDEX_SQL = [
+    'CREATE INDEX events_country_date ON events (country_txt, date)',
+    'CREATE INDEX events_year ON events (iyear, country_txt, nkill, nwound)',
+    'CREATE INDEX events_provstate ON events (country_txt, provstate, date)',
+    'CREATE INDEX events_city ON events (country_txt, city, date)',
+    'CREATE INDEX events_gname ON events (country_txt, gname, date)',
+]
+
+_backend = None
+_lock = threading.Lock()
+
+
+def _day(date):
+    return int((np.datetime64(date, 'D') - EPOCH).astype('int64'))
+
+
+def _placeholders(values):
+    return ', '.join('?' * len(values))
+
+
+class PandasBackend:
+    """Answers from the in-memory snapshot of ``apps.data``."""
+
+    def warm(self):
+        """Build everything the callbacks use, e.g. before forking workers."""
+        data.current().summaries()
+        lookup.get_index()
+        rollups.get_cube()
+
+    def version(self):
+        return data.version()
+
+    def countries(self):
+        return data.country_names()
+
+    def values(self, country, column):
+        return lookup.get_index().values(country, column)
+
+    def annual(self, country, years, measure='counts'):
+        return rollups.get_cube().annual(country, years, measure)
+
+    def top(self, years, measure='counts', n=20):
+        return rollups.get_cube().top(years, measure, n)
+
+    def world_events(self, countries, years):
+        terrorism = data.get_terrorism()
+        return terrorism[terrorism['country_txt'].isin(countries) & terrorism['iyear'].between(years[0], years[1])]
+
+    def events(self, country, start=None, end=None, **selections):
+        return lookup.get_index().events(country, start, end, **selections)
+
+    def summaries(self, eventids):
+        return data.summaries(eventids)
+
+
+class SQLBackend:
+    """Answers with SQL against the database at ``path``.
+
+    Each process and thread gets its own read-only connection, reopened when
+    the file is replaced by a new build.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        raise NotImplementedError
+
+    def _frame(self, connection, sql, params):
+        raise NotImplementedError
+
+    def _connection(self):
+        stat = os.stat(self.path)
+        # connections must not be shared with forked workers
+        stamp = (os.getpid(), stat.st_ino, stat.st_mtime)
+        if getattr(self._local, 'stamp', None) != stamp:
+            self._local.connection = self._connect()
+            self._local.stamp = stamp
+            self._local.version = self._local.connection.execute(
+                "SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+        return self._local.connection
+
+    def warm(self):
+        pass
+
+    def query(self, sql, params=()):
+        return self._frame(self._connection(), sql, list(params))
+
+    def version(self):
+        self._connection()
+        return self._local.version
+
+    def countries(self):
+        return self.query('SELECT DISTINCT country_txt FROM events '
+                          'WHERE country_txt IS NOT NULL ORDER BY country_txt')['country_txt'].tolist()
+
+    def values(self, country, column):
+        if column not in lookup.POSTING_COLUMNS:
+            raise ValueError('no index on {!r}'.format(column))
+        sql = ('SELECT DISTINCT {0} FROM events WHERE country_txt = ? AND {0} IS NOT NULL '
+               'ORDER BY {0}').format(column)
+        return self.query(sql, [country])[column].tolist()
+
+    def annual(self, country, years, measure='counts'):
+        sql = ('SELECT iyear, {} AS value FROM events WHERE country_txt = ? AND iyear BETWEEN ? AND ? '
+               'GROUP BY iyear ORDER BY iyear').format(MEASURES[measure])
+        df = self.query(sql, [country, int(years[0]), int(years[1])])
+        return df['iyear'].values, df['value'].values
+
+    def top(self, years, measure='counts', n=20):
+        sql = ('SELECT country_txt, {} AS value FROM events WHERE iyear BETWEEN ? AND ? '
+               'AND country_txt IS NOT NULL GROUP BY country_txt').format(MEASURES[measure])
+        df = self.query(sql, [int(years[0]), int(years[1])])
+        # ascending, ties in name order, like CountryYearCube.top
+        df = df[df['value'] > 0].sort_values(['value', 'country_txt'], kind='mergesort')
+        if n is not None:
+            df = df.iloc[-n:]
+        return df['country_txt'].tolist(), df['value'].values
+
+    def _events(self, where, params):
+        sql = 'SELECT {} FROM events WHERE {} ORDER BY row'.format(', '.join(EVENT_COLUMNS), where)
+        df = self.query(sql, params)
+        df['date'] = (EPOCH + df['date'].values.astype('int64')).astype('datetime64[ns]')
+        return df
+
+    def world_events(self, countries, years):
+        countries = [c for c in countries if c]
+        if not countries:
+            return self._events('0 = 1', [])
+        where = 'country_txt IN ({}) AND iyear BETWEEN ? AND ?'.format(_placeholders(countries))
+        return self._events(where, countries + [int(years[0]), int(years[1])])
+
+    def _where(self, country, start, end, selections):
+        where, params = ['country_txt = ?'], [country]
+        if start is not None:
+            where.append('date >= ?')
+            params.append(_day(start))
+        if end is not None:
+            where.append('date <= ?')
+            params.append(_day(end))
+        if selections:
+            # any of the selected values, like the posting lists of lookup.EventIndex
+            terms = []
+            for column, values in selections.items():
+                if column not in lookup.POSTING_COLUMNS:
+                    raise ValueError('no index on {!r}'.format(column))
+                values = [v for v in values if v]
+                if values:
+                    terms.append('{} IN ({})'.format(column, _placeholders(values)))
+                    params += values
+            where.append('({})'.format(' OR '.join(terms) or '0 = 1'))
+        return ' AND '.join(where), params
+
+    def events(self, country, start=None, end=None, **selections):
+        return self._events(*self._where(country, start, end, selections))
+
+    def summaries(self, eventids):
+        eventids = [int(e) for e in eventids]
+        df = self.query(self.SUMMARIES_SQL, [self._id_list(sorted(set(eventids)))])
+        found = dict(zip(df['eventid'].tolist(), df['summary'].tolist()))
+        return np.array([found.get(e) or '' for e in eventids], dtype=object)
+
+
+class SQLiteBackend(SQLBackend):
+
+    # one statement for any number of ids, each looked up in the primary key
+    SUMMARIES_SQL = ('SELECT s.eventid, s.summary FROM json_each(?) AS ids '
+                     'JOIN summaries AS s ON s.eventid = ids.value')
+
+    @staticmethod
+    def _id_list(ids):
+        return json.dumps(ids)
+
+    def _connect(self):
+        uri = 'file:{}?mode=ro'.format(os.path.abspath(self.path))
+        return sqlite3.connect(uri, uri=True)
+
+    def _frame(self, connection, sql, params):
+        return pd.read_sql_query(sql, connection, params=params)
+
+
+class DuckDBBackend(SQLBackend):
+
+    SUMMARIES_SQL = 'SELECT eventid, summary FROM summaries WHERE eventid IN (SELECT UNNEST(?::BIGINT[]))'
+
+    @staticmethod
+    def _id_list(ids):
+        return ids
+
+    def _connect(self):
+        return duckdb.connect(self.path, read_only=True)
+
+    def _frame(self, connection, sql, params):
+        return connection.execute(sql, params).df()
+
+
+ENGINES = {'sqlite': SQLiteBackend, 'duckdb': DuckDBBackend}
+
+
+def default_path(engine):
+    return QUERY_DB or os.path.splitext(data.DATA_PATH)[0] + '.' + engine
+
+
+def _frames(chunksize=200000):
+    """The events and summaries of the loaded dataset, as database rows."""
+    terrorism = data.get_terrorism()
+    for start in range(0, len(terrorism), chunksize):
+        df = terrorism.iloc[start:start + chunksize]
+        events = pd.DataFrame({col: df[col].astype(object) if df[col].dtype.name == 'category' else df[col]
+                               for col in EVENT_COLUMNS})
+        events['date'] = (df['date'].values.astype('datetime64[D]') - EPOCH).astype('int64')
+        events.insert(0, 'row', np.arange(start, start + len(df)))
+        summaries = pd.DataFrame({'eventid': df['eventid'].values,
+                                  'summary': data.summaries(df['eventid'].values)})
+        yield events, summaries
+
+
+def build(engine='sqlite', path=None):
+    """Write the loaded dataset to a new ``engine`` database at ``path``."""
+    path = path or default_path(engine)
+    with files.replacing(path) as tmp:
+        if engine == 'sqlite':
+            connection = sqlite3.connect(tmp)
+        else:
+            connection = duckdb.connect(tmp)
+        for statement in SCHEMA_SQL:
+            connection.execute(statement)
+        for events, summaries in _frames():
+            if engine == 'sqlite':
+                events.to_sql('events', connection, if_exists='append', index=False)
+                summaries.to_sql('summaries', connection, if_exists='append', index=False)
+            else:
+                connection.register('chunk', events)
+                connection.execute('INSERT INTO events SELECT * FROM chunk')
+                connection.register('chunk', summaries)
+                connection.execute('INSERT INTO summaries SELECT * FROM chunk')
+                connection.unregister('chunk')
+        for statement in INDEX_SQL:
+            connection.execute(statement)
+        connection.execute("INSERT INTO meta VALUES ('version', ?)", [data.version()])
+        if engine == 'sqlite':
+            connection.commit()
+            connection.execute('ANALYZE')
+        connection.close()
+    return path
+
+
+def make_backend(name=QUERY_BACKEND, path=None):
+    if name == 'pandas':
+        return PandasBackend()
+    if name not in ENGINES:
+        raise ValueError('unknown query backend {!r}'.format(name))
+    path = path or default_path(name)
+    if name == 'duckdb' and duckdb is None:
+        warnings.warn('duckdb is not installed, falling back to the pandas backend')
+        return PandasBackend()
+    if not os.path.exists(path):
+        warnings.warn('{} does not exist (python -m apps.query --engine {}), '
+                      'falling back to the pandas backend'.format(path, name))
+        return PandasBackend()
+    return ENGINES[name](path)
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                _backend = make_backend()
+    return _backend
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the query database of the GTD.')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='sqlite')
+    parser.add_argument('--db', help='path of the database (default: next to the CSV)')
+    args = parser.parse_args(argv)
+    if args.engine == 'duckdb' and duckdb is None:
+        parser.error('the duckdb package is not installed')
+    path = build(args.engine, args.db)
+    print('wrote {} database {}'.format(args.engine, path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Pre-aggregated (country x year) cubes for the world page.
+
+Event counts, death sums and wound sums are bincounted once per country and
+year.  Each cube also keeps a cumulative sum along the year axis, so the
+totals for any year range are a single subtraction instead of a scan over
+the events.
+
+When a data update only touches a few countries, ``updated()`` recomputes
+their rows and keeps the others.
+"""
+import numpy as np
+
+from apps import data
+
+
+class CountryYearCube:
+
+    def __init__(self, terrorism, years=None):
+        country = terrorism['country_txt'].cat
+        self.countries = country.categories
+        if years is None:
+            years = terrorism['iyear'].min(), terrorism['iyear'].max()
+        self.first_year, self.last_year = int(years[0]), int(years[1])
+        n_years = self.last_year - self.first_year + 1
+
+        codes = country.codes.values.astype('int64')
+        keep = codes >= 0
+        cells = codes[keep] * n_years + (terrorism['iyear'].values[keep] - self.first_year)
+        size = len(self.countries) * n_years
+        shape = (len(self.countries), n_years)
+
+        def cube(weights=None):
+            if weights is not None:
+                weights = np.nan_to_num(weights[keep].astype('float64'))
+            return np.bincount(cells, weights=weights, minlength=size).reshape(shape)
+
+        self.counts = cube().astype('int64')
+        self.deaths = cube(terrorism['nkill'].values)
+        self.wounds = cube(terrorism['nwound'].values)
+        self._accumulate()
+
+    def _accumulate(self):
+        self._cumulative = {name: self._cumsum(getattr(self, name))
+                            for name in ['counts', 'deaths', 'wounds']}
+
+    def updated(self, terrorism, countries):
+        """The cube of ``terrorism``, where only ``countries`` changed since this one."""
+        country = terrorism['country_txt'].cat
+        first, last = int(terrorism['iyear'].min()), int(terrorism['iyear'].max())
+        if (not country.categories.equals(self.countries)
+                or (first, last) != (self.first_year, self.last_year)):
+            return CountryYearCube(terrorism)
+        changed = terrorism[country.codes.isin(self.countries.get_indexer(countries)).values]
+        delta = CountryYearCube(changed, (first, last))
+        rows = self.countries.get_indexer(countries)
+        rows = rows[rows >= 0]
+        cube = CountryYearCube.__new__(CountryYearCube)
+        cube.countries, cube.first_year, cube.last_year = self.countries, first, last
+        for name in ['counts', 'deaths', 'wounds']:
+            values = getattr(self, name).copy()
+            values[rows] = getattr(delta, name)[rows]
+            setattr(cube, name, values)
+        cube._accumulate()
+        return cube
+
+    @staticmethod
+    def _cumsum(cube):
+        cum = np.zeros((cube.shape[0], cube.shape[1] + 1), dtype=cube.dtype)
+        np.cumsum(cube, axis=1, out=cum[:, 1:])
+        return cum
+
+    def _year_slice(self, years):
+        # empty when the range is outside the loaded years (see TERRORISM_YEARS)
+        n_years = self.last_year - self.first_year + 1
+        start = min(max(int(years[0]), self.first_year) - self.first_year, n_years)
+        stop = min(int(years[1]), self.last_year) - self.first_year + 1
+        return start, max(start, stop)
+
+    def totals(self, years, measure='counts'):
+        """Per-country total of ``measure`` over the inclusive ``years`` range."""
+        start, stop = self._year_slice(years)
+        cum = self._cumulative[measure]
+        return cum[:, stop] - cum[:, start]
+
+    def top(self, years, measure='counts', n=20):
+        """Return the ``n`` (or all) countries with the largest totals, in ascending order."""
+        totals = self.totals(years, measure)
+        order = np.argsort(totals, kind='mergesort')
+        order = order[totals[order] > 0]
+        if n is not None:
+            order = order[-n:]
+        return self.countries[order].tolist(), totals[order]
+
+    def annual(self, country, years, measure='counts'):
+        """Return the years and yearly values of ``country`` where it had events."""
+        start, stop = self._year_slice(years)
+        if country not in self.countries:
+            return np.array([], dtype='int64'), np.array([])
+        row = self.countries.get_loc(country)
+        counts = self.counts[row, start:stop]
+        values = getattr(self, measure)[row, start:stop]
+        year_values = np.arange(start, stop) + self.first_year
+        return year_values[counts > 0], values[counts > 0]
+
+
+def get_cube() -> CountryYearCube:
+    return data.current().derived('cube', CountryYearCube, CountryYearCube.updated)
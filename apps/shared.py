@@ -0,0 +1,57 @@
+"""Selections shared by sibling callbacks.
+
+Dash fires the callbacks of a page that depend on the same inputs as separate
+requests, at the same moment, and each of them used to filter the events the
+same way.  ``selections.get(key, compute)`` runs ``compute`` for the first of
+them; the others, in other threads or a little later, wait for and reuse its
+result.  Entries only live for ``TERRORISM_SHARED_TTL`` seconds (default 5),
+about the length of one interaction.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from apps import query
+
+SHARED_TTL = float(os.environ.get('TERRORISM_SHARED_TTL', 5))
+
+
+class SharedSelections:
+
+    def __init__(self, ttl=SHARED_TTL, maxsize=32):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.computed = self.shared = 0
+
+    def get(self, key, compute):
+        """Return ``compute()``, computed once for all the callers of ``key``."""
+        key = json.dumps([query.get_backend().version(), key], default=str)
+        now = time.monotonic()
+        with self._lock:
+            for k in [k for k, (expires, _) in self._entries.items() if expires < now]:
+                del self._entries[k]
+            owner = key not in self._entries
+            if owner:
+                self._entries[key] = (now + self.ttl, Future())
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                self.computed += 1
+            else:
+                self.shared += 1
+            future = self._entries[key][1]
+        if owner:
+            try:
+                future.set_result(compute())
+            except BaseException as e:
+                future.set_exception(e)
+                with self._lock:
+                    self._entries.pop(key, None)
+        return future.result()
+
+
+selections = SharedSelections()
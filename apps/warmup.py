@@ -0,0 +1,111 @@
+"""Render the most requested figures into the shared figure store.
+
+Run after a deploy (or a data update), before the workers take traffic:
+
+    TERRORISM_FIGURE_CACHE_DIR=/var/cache/terrorism python -m apps.warmup --processes 8
+
+Renders, with a pool of processes, the figures of the default views of both
+pages, for every country (or the ``--top`` ones) and each ``--years`` range,
+and writes them to ``TERRORISM_FIGURE_CACHE_DIR``, where the workers' figure
+caches find them (see ``apps.figcache``).  Figures already in the store for
+the current dataset, code and settings are skipped unless ``--force`` is
+given; figures drawn by a previous deploy have other keys and are rendered
+again.
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+DEFAULT_YEARS = ['2010-2016', '1970-2016']
+# the country page sliders: Jan 2010 - Dec 2016
+DEFAULT_MONTHS = [480, 563]
+
+
+def jobs(countries, year_ranges, months=DEFAULT_MONTHS):
+    """(callback, args) of the figures to render, as the Dash callbacks receive them."""
+    calls = []
+    for years in year_ranges:
+        calls += [('top_countries_count', (years,)),
+                  ('top_countries_deaths', (years,)),
+                  ('annual_by_country_barchart', ([''], years)),
+                  ('countries_on_map', ([''], years))]
+        for country in countries:
+            calls += [('annual_by_country_barchart', ([country], years)),
+                      ('countries_on_map', ([country], years))]
+    for country in [''] + countries:
+        calls += [('plot_cities_map', ([''], [''], months, country)),
+                  ('plot_cities_barchart', ([''], [''], months, country)),
+                  ('plot_perps_map', ([''], months, country))]
+    return calls
+
+
+def _init():
+    # registers the figure callbacks in this process
+    from apps import world, country  # noqa: F401
+
+
+def render(job, force=False):
+    """Render one figure into the store; return (callback, seconds, rendered)."""
+    from apps import figcache
+    name, args = job
+    func = figcache.figures[name]
+    key = figcache.make_key(func, args, {})
+    start = time.perf_counter()
+    if not force and figcache.cache.contains(key):
+        return name, time.perf_counter() - start, False
+    figcache.cache.set(key, func(*args))
+    return name, time.perf_counter() - start, True
+
+
+def _render(job_and_force):
+    return render(*job_and_force)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render popular figures into the shared figure store.')
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--top', type=int, help='only the countries with most attacks (default: all)')
+    parser.add_argument('--years', action='append',
+                        help='year range of the world page, e.g. 2010-2016 (repeatable; default: {})'.format(
+                            ', '.join(DEFAULT_YEARS)))
+    parser.add_argument('--force', action='store_true', help='render figures already in the store')
+    args = parser.parse_args(argv)
+
+    if not os.environ.get('TERRORISM_FIGURE_CACHE_DIR'):
+        parser.error('set TERRORISM_FIGURE_CACHE_DIR to the figure store of the workers')
+    from apps import query
+    # loaded once here, shared with the forked processes
+    backend = query.get_backend()
+    backend.warm()
+    _init()
+    if args.top:
+        countries = backend.top([1970, 2016], n=args.top)[0][::-1]
+    else:
+        countries = backend.countries()
+    year_ranges = [[int(y) for y in r.split('-')] for r in args.years or DEFAULT_YEARS]
+    todo = jobs(countries, year_ranges)
+
+    start = time.perf_counter()
+    rendered, skipped, seconds = {}, 0, 0
+    with multiprocessing.Pool(args.processes, initializer=_init) as pool:
+        for name, elapsed, done in pool.imap_unordered(_render, [(job, args.force) for job in todo], chunksize=4):
+            if done:
+                rendered[name] = rendered.get(name, 0) + 1
+                seconds += elapsed
+            else:
+                skipped += 1
+    wall = time.perf_counter() - start
+
+    total = sum(rendered.values())
+    print('{:<28} {:>8}'.format('callback', 'rendered'))
+    for name, n in sorted(rendered.items()):
+        print('{:<28} {:>8}'.format(name, n))
+    print('\nrendered {} figures ({} already stored) in {:.1f} s with {} processes: '
+          '{:.1f} figures/s, {:.0f} ms of work per figure'.format(
+              total, skipped, wall, args.processes, total / wall if wall else 0,
+              1000 * seconds / total if total else 0))
+
+
+if __name__ == '__main__':
+    main()
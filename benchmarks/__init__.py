@@ -0,0 +1,5 @@
+"""Offline benchmarks for the dashboard's data layer.
+
+Run a benchmark as a module from the repository root, e.g.
+``python -m benchmarks.bench_dates``.
+"""
@@ -0,0 +1,55 @@
+"""Micro-benchmark: vectorized ``make_dates`` vs the old per-row loop.
+
+Exits with a non-zero status when the speedup drops below ``--min-speedup``,
+so it can be used to catch regressions.
+"""
+import argparse
+import datetime
+import sys
+import timeit
+
+import numpy as np
+
+from apps.data import make_dates
+
+
+def legacy_dates(years, months, days):
+    day_clean = [15 if x == 0 else x for x in days]
+    dates = [datetime.datetime(y, m, d) for y, m, d in zip(years, months, day_clean)]
+    # assigning the list to a frame column converted it to datetime64 as well
+    return np.array(dates, dtype='datetime64[ns]')
+
+
+def synthetic_ymd(rows, seed=0):
+    rng = np.random.RandomState(seed)
+    years = rng.randint(1970, 2017, rows)
+    months = rng.randint(1, 13, rows)
+    # days 0-28 are valid in every month, so both versions agree
+    days = rng.randint(0, 29, rows)
+    return years, months, days
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=170000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-speedup', type=float, default=0)
+    args = parser.parse_args(argv)
+
+    years, months, days = synthetic_ymd(args.rows)
+    if not (make_dates(years, months, days) == legacy_dates(years, months, days)).all():
+        sys.exit('make_dates does not match the legacy implementation')
+
+    legacy = min(timeit.repeat(lambda: legacy_dates(years, months, days), number=1, repeat=args.repeat))
+    vectorized = min(timeit.repeat(lambda: make_dates(years, months, days), number=1, repeat=args.repeat))
+    speedup = legacy / vectorized
+    print('rows: {:,}'.format(args.rows))
+    print('legacy:     {:8.1f} ms'.format(legacy * 1000))
+    print('vectorized: {:8.1f} ms'.format(vectorized * 1000))
+    print('speedup:    {:8.1f}x'.format(speedup))
+    if speedup < args.min_speedup:
+        sys.exit('speedup {:.1f}x is below the required {:.1f}x'.format(speedup, args.min_speedup))
+
+
+if __name__ == '__main__':
+    main()
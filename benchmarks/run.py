@@ -0,0 +1,169 @@
+"""Benchmark the page callbacks against a synthetic dataset.
+
+Imports ``apps.world`` and ``apps.country`` against a synthetic GTD-shaped
+CSV of ``--rows`` events (or ``--data``), calls every callback with the
+recorded and randomized inputs of ``benchmarks.workloads`` and reports
+p50/p95/p99 latency, response size and peak memory.  Runs offline, without
+a browser or a server.
+
+Results can be stored with ``--save-baseline`` and are compared with the
+stored baseline for the same number of rows on later runs;
+``--max-regression`` turns a slower p95 into a non-zero exit status.
+
+    python -m benchmarks --rows 1000000
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks import synthetic, workloads
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(HERE, 'baseline.json')
+DATA_DIR = os.path.join(HERE, 'data')
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(samples):
+    latencies = np.array([s['seconds'] for s in samples]) * 1000
+    payloads = np.array([s['bytes'] for s in samples])
+    summary = {'calls': len(samples),
+               'p50_ms': float(np.percentile(latencies, 50)),
+               'p95_ms': float(np.percentile(latencies, 95)),
+               'p99_ms': float(np.percentile(latencies, 99)),
+               'mean_bytes': float(payloads.mean()),
+               'max_bytes': int(payloads.max())}
+    if samples[0].get('peak_bytes') is not None:
+        summary['peak_alloc_mb'] = max(s['peak_bytes'] for s in samples) / 2 ** 20
+    return summary
+
+
+def run(calls, trace_memory=False):
+    from plotly.utils import PlotlyJSONEncoder
+    from apps import metrics
+
+    samples = {}
+    for name, args in calls:
+        callback = metrics.callbacks[name]
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = callback(*args)
+        seconds = time.perf_counter() - start
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        samples.setdefault(name, []).append({
+            'seconds': seconds,
+            'bytes': len(json.dumps(result, cls=PlotlyJSONEncoder)),
+            'peak_bytes': peak,
+        })
+    return {name: summarize(s) for name, s in samples.items()}
+
+
+def compare(results, baseline, max_regression):
+    """Print the change from ``baseline``; return the regressed callbacks."""
+    regressed = []
+    print('\n{:<28} {:>10} {:>10} {:>8} {:>12}'.format('vs baseline', 'p95 ms', 'was', 'change', 'bytes change'))
+    for name, r in sorted(results['callbacks'].items()):
+        b = baseline['callbacks'].get(name)
+        if b is None:
+            continue
+        change = r['p95_ms'] / b['p95_ms'] - 1 if b['p95_ms'] else 0
+        bytes_change = r['mean_bytes'] / b['mean_bytes'] - 1 if b['mean_bytes'] else 0
+        print('{:<28} {:>10.2f} {:>10.2f} {:>+7.0%} {:>+12.0%}'.format(name, r['p95_ms'], b['p95_ms'], change, bytes_change))
+        if max_regression is not None and change > max_regression:
+            regressed.append(name)
+    return regressed
+
+
+def report(results):
+    print('rows: {rows:,}   load: {load_seconds:.2f} s   peak RSS: {peak_rss_mb:.0f} MB'.format(**results))
+    print('\n{:<28} {:>6} {:>9} {:>9} {:>9} {:>11} {:>11}'.format(
+        'callback', 'calls', 'p50 ms', 'p95 ms', 'p99 ms', 'mean bytes', 'max bytes'))
+    for name, r in sorted(results['callbacks'].items()):
+        print('{:<28} {calls:>6} {p50_ms:>9.2f} {p95_ms:>9.2f} {p99_ms:>9.2f} {mean_bytes:>11,.0f} {max_bytes:>11,}'.format(name, **r))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=170000,
+                        help='size of the synthetic dataset (e.g. 170000, 1000000, 10000000)')
+    parser.add_argument('--data', help='benchmark this CSV instead of a synthetic one')
+    parser.add_argument('--iterations', type=int, default=20,
+                        help='rounds of randomized inputs, on top of the recorded ones')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=['pandas', 'sqlite', 'duckdb'], default='pandas',
+                        help='query backend of the callbacks (the database is built if missing)')
+    parser.add_argument('--figure-cache', action='store_true',
+                        help='keep the figure cache on (off by default, to measure computation)')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='record the peak allocation of each call (slower)')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--max-regression', type=float,
+                        help='fail if a p95 is this much slower than the baseline (0.2 = 20%%)')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    path = args.data or synthetic.dataset(args.rows, DATA_DIR, args.seed)
+    os.environ['TERRORISM_DATA_PATH'] = path
+    os.environ['TERRORISM_QUERY_BACKEND'] = args.backend
+    os.environ.pop('TERRORISM_QUERY_DB', None)
+    os.environ.pop('TERRORISM_FIGURE_CACHE_DIR', None)
+    if not args.figure_cache:
+        os.environ['TERRORISM_FIGURE_CACHE_SIZE'] = '0'
+
+    if args.backend != 'pandas':
+        from apps import query
+        if not os.path.exists(query.default_path(args.backend)):
+            query.build(args.backend)
+
+    start = time.perf_counter()
+    from apps import data, lookup, rollups, world, country  # noqa: F401 (registers the callbacks)
+    terrorism = data.get_terrorism()
+    index = lookup.get_index()
+    countries = rollups.get_cube().top([workloads.FIRST_YEAR, workloads.LAST_YEAR], n=None)[0][::-1]
+    load_seconds = time.perf_counter() - start
+
+    rng = np.random.RandomState(args.seed)
+    calls = workloads.RECORDED + workloads.random_calls(rng, index, countries, args.iterations)
+    results = {'rows': len(terrorism),
+               'load_seconds': load_seconds,
+               'callbacks': run(calls, args.trace_memory),
+               'peak_rss_mb': peak_rss_mb()}
+    report(results)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    key = str(args.rows if not args.data else os.path.basename(args.data))
+    if args.backend != 'pandas':
+        key += '-' + args.backend
+    regressed = []
+    if key in baselines:
+        regressed = compare(results, baselines[key], args.max_regression)
+    if args.save_baseline:
+        baselines[key] = results
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if regressed:
+        sys.exit('p95 regressed by more than {:.0%}: {}'.format(args.max_regression, ', '.join(regressed)))
+
+
+if __name__ == '__main__':
+    main()
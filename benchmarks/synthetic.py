@@ -0,0 +1,130 @@
+"""Synthetic, GTD-shaped datasets of any size.
+
+The CSV has the columns the dashboard reads, with skewed (Zipf-like)
+distributions so that a few countries, cities and groups dominate like they
+do in the real data.  It is written in chunks, so even 10M rows are
+generated with bounded memory.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# the countries with the most attacks in the GTD, most frequent first
+COUNTRIES = ['Iraq', 'Pakistan', 'Afghanistan', 'India', 'Colombia', 'Philippines', 'Peru',
+             'El Salvador', 'United Kingdom', 'Turkey', 'Somalia', 'Nigeria', 'Thailand',
+             'Yemen', 'Spain', 'Sri Lanka', 'United States', 'Algeria', 'France', 'Egypt',
+             'Lebanon', 'Chile', 'Libya', 'Syria', 'Israel', 'Russia', 'Ukraine', 'Sudan',
+             'Guatemala', 'Nicaragua', 'South Africa', 'Bangladesh', 'Greece', 'Italy',
+             'Germany', 'Nepal', 'Indonesia', 'Kenya', 'Mexico', 'Iran']
+COUNTRY_COUNT = 205
+PROVSTATES_PER_COUNTRY = 30
+CITIES_PER_PROVSTATE = 40
+GROUPS_PER_COUNTRY = 60
+TARGETS = 5000
+SUMMARIES = 2000
+WORDS = ('attack bomb explosion assailants killed wounded police station market '
+         'village convoy checkpoint claimed responsibility unknown group armed '
+         'civilians soldiers vehicle detonated near city district province').split()
+
+CHUNK_ROWS = 500000
+
+
+def zipf_choice(rng, n, size, a=1.3):
+    """Indices in ``range(n)``, index 0 the most frequent."""
+    weights = 1 / np.arange(1, n + 1) ** a
+    return rng.choice(n, size=size, p=weights / weights.sum())
+
+
+def country_names():
+    return COUNTRIES + ['Country {}'.format(i) for i in range(len(COUNTRIES), COUNTRY_COUNT)]
+
+
+def make_chunk(rng, start, rows):
+    countries = np.array(country_names(), dtype=object)
+    country = zipf_choice(rng, len(countries), rows)
+    provstate = zipf_choice(rng, PROVSTATES_PER_COUNTRY, rows, a=1.1)
+    city = zipf_choice(rng, CITIES_PER_PROVSTATE, rows, a=1.1)
+    group = zipf_choice(rng, GROUPS_PER_COUNTRY, rows, a=1.5)
+
+    years = np.sort(rng.randint(1970, 2017, rows))
+    months = rng.randint(1, 13, rows)
+    months[rng.rand(rows) < .001] = 0
+    days = rng.randint(1, 29, rows)
+    days[rng.rand(rows) < .02] = 0
+
+    # every country gets a centre; events scatter around it by province
+    centre_lon = (country * 37.0) % 340 - 170
+    centre_lat = (country * 23.0) % 120 - 60
+    lon = centre_lon + provstate * .3 + rng.normal(0, .5, rows)
+    lat = centre_lat + city * .05 + rng.normal(0, .5, rows)
+    missing_coords = rng.rand(rows) < .02
+
+    nkill = rng.poisson(2, rows).astype('float64')
+    nkill[rng.rand(rows) < .05] = np.nan
+    nwound = rng.poisson(3, rows).astype('float64')
+    nwound[rng.rand(rows) < .08] = np.nan
+
+    summaries = np.array([' '.join(rng.choice(WORDS, rng.randint(8, 60))) for _ in range(SUMMARIES)], dtype=object)
+    summary = summaries[rng.randint(0, SUMMARIES, rows)]
+    summary[rng.rand(rows) < .4] = np.nan
+
+    country_name = countries[country]
+    provstate_name = np.char.add(np.char.add(country_name.astype(str), ' Province '), provstate.astype(str))
+    provstate_name = provstate_name.astype(object)
+    provstate_name[rng.rand(rows) < .01] = np.nan
+    city_name = np.char.add(np.char.add(country_name.astype(str), ' City '),
+                            (provstate * CITIES_PER_PROVSTATE + city).astype(str))
+    gname = np.where(group == 0, 'Unknown',
+                     np.char.add(np.char.add(country_name.astype(str), ' Group '), group.astype(str)))
+
+    return pd.DataFrame({
+        'eventid': (years.astype('int64') * 10000 + months * 100 + days) * 10 ** 8 + np.arange(start, start + rows),
+        'iyear': years,
+        'imonth': months,
+        'iday': days,
+        'country_txt': country_name,
+        'provstate': provstate_name,
+        'city': city_name,
+        'longitude': np.where(missing_coords, np.nan, lon.round(6)),
+        'latitude': np.where(missing_coords, np.nan, lat.round(6)),
+        'nkill': nkill,
+        'nwound': nwound,
+        'summary': summary,
+        'target1': np.char.add('Target ', zipf_choice(rng, TARGETS, rows).astype(str)),
+        'gname': gname,
+    })
+
+
+def write_csv(path, rows, seed=0):
+    rng = np.random.RandomState(seed)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='latin-1') as f:
+        for start in range(0, rows, CHUNK_ROWS):
+            chunk = make_chunk(rng, start, min(CHUNK_ROWS, rows - start))
+            chunk.to_csv(f, index=False, header=start == 0)
+    os.replace(tmp, path)
+    return path
+
+
+def dataset(rows, directory, seed=0):
+    """Path of a synthetic CSV with ``rows`` events, generated if missing."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'gtd-{}-{}.csv'.format(rows, seed))
+    if not os.path.exists(path):
+        write_csv(path, rows, seed)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic GTD-shaped CSV.')
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=170000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    write_csv(args.path, args.rows, args.seed)
+
+
+if __name__ == '__main__':
+    main()
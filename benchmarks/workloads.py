@@ -0,0 +1,73 @@
+"""Inputs for the page callbacks.
+
+``RECORDED`` holds the views people actually open: the defaults of both
+pages and a few common selections.  ``random_calls()`` draws the rest from
+distributions shaped like real use: slider ranges of any width, multi-country
+selections skewed towards the countries with most attacks, and the heaviest
+provinces, cities and perpetrators of a country.
+"""
+import numpy as np
+
+# (callback, args), as the Dash callbacks receive them
+RECORDED = [
+    ('annual_by_country_barchart', ([''], [2010, 2016])),
+    ('countries_on_map', ([''], [2010, 2016])),
+    ('top_countries_count', ([2010, 2016],)),
+    ('top_countries_deaths', ([2010, 2016],)),
+    ('annual_by_country_barchart', (['Iraq', 'Afghanistan', 'Pakistan'], [2010, 2016])),
+    ('countries_on_map', (['Iraq'], [2010, 2016])),
+    ('countries_on_map', (['Iraq', 'Afghanistan', 'Pakistan', 'India'], [1970, 2016])),
+    ('set_provstate_options', ('Iraq',)),
+    ('set_city_options', ('Iraq',)),
+    ('set_perpetrator_options', ('Iraq',)),
+    ('plot_cities_map', ([''], [''], [480, 563], 'Iraq')),
+    ('plot_cities_barchart', ([''], [''], [480, 563], 'Iraq')),
+    ('plot_perps_map', ([''], [480, 563], 'Iraq')),
+]
+
+FIRST_YEAR, LAST_YEAR = 1970, 2016
+MONTHS = 564
+
+
+def _range(rng, low, high):
+    start = rng.randint(low, high + 1)
+    return [start, rng.randint(start, high + 1)]
+
+
+def _skewed(rng, values, k):
+    """``k`` distinct values, the first ones (most frequent) more likely."""
+    weights = 1 / np.arange(1, len(values) + 1)
+    k = min(k, len(values))
+    return [values[i] for i in rng.choice(len(values), k, replace=False, p=weights / weights.sum())]
+
+
+def random_calls(rng, index, countries, n):
+    """``n`` randomized calls; ``countries`` is ordered by number of attacks."""
+    calls = []
+    for _ in range(n):
+        country = _skewed(rng, countries, 1)[0]
+        years = _range(rng, FIRST_YEAR, LAST_YEAR)
+        months = _range(rng, 0, MONTHS - 1)
+        selected = _skewed(rng, countries, rng.randint(1, 13))
+        provstates = _skewed(rng, _by_size(index, country, 'provstate'), rng.randint(0, 4)) or ['']
+        cities = _skewed(rng, _by_size(index, country, 'city'), rng.randint(0, 6)) or ['']
+        perps = _skewed(rng, _by_size(index, country, 'gname'), rng.randint(1, 12))
+        calls += [
+            ('annual_by_country_barchart', (selected, years)),
+            ('countries_on_map', (selected, years)),
+            ('top_countries_count', (years,)),
+            ('top_countries_deaths', (_range(rng, FIRST_YEAR, LAST_YEAR),)),
+            ('set_provstate_options', (country,)),
+            ('set_city_options', (country,)),
+            ('set_perpetrator_options', (country,)),
+            ('plot_cities_map', (provstates, cities, months, country)),
+            ('plot_cities_barchart', (provstates, cities, months, country)),
+            ('plot_perps_map', (perps, months, country)),
+        ]
+    return calls
+
+
+def _by_size(index, country, column):
+    """Values of ``column`` in ``country``, those with most events first."""
+    postings = index.postings.get(country, {}).get(column, {})
+    return sorted(postings, key=lambda value: -len(postings[value]))
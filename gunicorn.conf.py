@@ -0,0 +1,33 @@
+"""gunicorn settings: ``gunicorn -c gunicorn.conf.py index:server``.
+
+The app is preloaded in the master: the data, its index, its rollups and the
+dropdown options are built once, the objects are moved out of the garbage
+collector's reach (``gc.freeze``) so collections in the workers do not write
+to them, and only then are the workers forked.  The workers share those pages copy-on-write
+instead of each loading its own copy; every worker logs how much of its
+memory is still shared once it starts (and ``/metrics`` keeps reporting it).
+
+``TERRORISM_PRELOAD=0`` turns preloading off; ``WEB_CONCURRENCY`` sets the
+number of workers.
+"""
+import gc
+import os
+
+preload_app = os.environ.get('TERRORISM_PRELOAD', '1') != '0'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from apps import memory, options, query
+    query.get_backend().warm()
+    options.get_table()
+    gc.collect()
+    gc.freeze()
+    server.log.info('preloaded the data: %s', memory.report())
+
+
+def post_worker_init(worker):
+    from apps import memory
+    worker.log.info('worker %s: %s', worker.pid, memory.report())
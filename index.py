@@ -4,7 +4,7 @@ import dash_html_components as html
 
 from app import app
 server = app.server
-from apps import world, country
+from apps import world, country, metrics
 
 
 app.layout = html.Div([
@@ -14,11 +14,12 @@ app.layout = html.Div([
 
 @app.callback(Output('page-content', 'children'),
              [Input('url', 'pathname')])
+@metrics.instrumented
 def display_page(pathname):
     if pathname == '/country':
-        return country.layout
+        return country.get_layout()
     else:
-        return world.layout
+        return world.get_layout()
 
 if __name__ == '__main__':
     app.run_server()
\ No newline at end of file
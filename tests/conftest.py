@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+from apps import data
+from benchmarks import synthetic
+
+
+@pytest.fixture(scope='session')
+def csv_path(tmp_path_factory):
+    """A small synthetic GTD-shaped CSV, shared by the tests that only read it."""
+    return synthetic.write_csv(str(tmp_path_factory.mktemp('gtd') / 'gtd.csv'), 6000)
+
+
+@pytest.fixture(scope='session')
+def snapshot(csv_path):
+    """The snapshot of ``csv_path``, loaded through its cache."""
+    return data._load_snapshot(csv_path, os.path.splitext(csv_path)[0] + '.feather')[0]
+
+
+@pytest.fixture
+def terrorism(snapshot, monkeypatch):
+    """Serve ``snapshot`` as the current dataset; returns its events frame."""
+    monkeypatch.setattr(data, '_snapshot', snapshot)
+    return snapshot.terrorism
@@ -0,0 +1,141 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from apps import data, lookup, rollups
+
+
+@pytest.fixture
+def cache(csv_path, tmp_path, monkeypatch):
+    """A CSV and its cache of our own, loaded as the current snapshot; returns their paths."""
+    path = str(tmp_path / 'gtd.csv')
+    shutil.copy(csv_path, path)
+    cache_path = str(tmp_path / 'gtd.feather')
+    data.build_cache(path, cache_path)
+    monkeypatch.setattr(data, '_snapshot', data._load_snapshot(path, cache_path)[0])
+    return path, cache_path
+
+
+def write_delta(path, source, country, seed):
+    """Change the group and deaths of some events of ``country`` and add new ones."""
+    rng = np.random.RandomState(seed)
+    events = pd.read_csv(source, encoding='latin-1')
+    events = events[events['country_txt'] == country]
+    changed = events.sample(20, random_state=rng).copy()
+    changed['gname'] = rng.choice(events['gname'].unique(), len(changed))
+    changed['nkill'] = rng.randint(0, 50, len(changed))
+    added = events.sample(10, random_state=rng).copy()
+    added['eventid'] = 900000000000 + seed * 1000 + np.arange(len(added))
+    added['provstate'] = 'New Province {}'.format(seed)
+    pd.concat([changed, added]).to_csv(path, index=False, encoding='latin-1')
+    return path
+
+
+def use_everything():
+    """Build the structures a worker derives, so that reload() updates them."""
+    lookup.get_index()
+    rollups.get_cube()
+
+
+def assert_index_matches(index, expected):
+    assert index.offsets == expected.offsets
+    assert index.postings.keys() == expected.postings.keys()
+    for country, columns in expected.postings.items():
+        for column, postings in columns.items():
+            got = index.postings[country][column]
+            assert got.keys() == postings.keys(), (country, column)
+            for value, positions in postings.items():
+                np.testing.assert_array_equal(got[value], positions, err_msg=str((country, column, value)))
+
+
+def assert_cube_matches(cube, expected):
+    assert list(cube.countries) == list(expected.countries)
+    for name in ['counts', 'deaths', 'wounds']:
+        np.testing.assert_array_equal(getattr(cube, name), getattr(expected, name))
+        np.testing.assert_array_equal(cube._cumulative[name], expected._cumulative[name])
+
+
+def assert_matches_full_rebuild(cache):
+    path, cache_path = cache
+    snapshot = data.current()
+    fresh = data._load_snapshot(path, cache_path)[0]
+    assert snapshot.version == fresh.version
+    pd.testing.assert_frame_equal(snapshot.terrorism, fresh.terrorism)
+    assert_index_matches(lookup.get_index(), lookup.EventIndex(fresh.terrorism))
+    assert_cube_matches(rollups.get_cube(), rollups.CountryYearCube(fresh.terrorism))
+
+
+def test_update_is_derived_incrementally(cache, tmp_path, monkeypatch):
+    path, cache_path = cache
+    use_everything()
+    delta = write_delta(str(tmp_path / 'd1.csv'), path, 'Peru', 1)
+    assert data.apply_update(delta, path, cache_path) == ['Peru']
+
+    rebuilt = []
+    monkeypatch.setattr(lookup.EventIndex, '__init__', _counting(lookup.EventIndex.__init__, rebuilt))
+    assert data.reload(path, cache_path)
+    assert not data.reload(path, cache_path)
+
+    # only updated, not rebuilt from scratch
+    assert rebuilt == [{'Peru'}]
+    assert_matches_full_rebuild(cache)
+    events = lookup.get_index().events('Peru', gname=['Peru Group 1'])
+    assert set(events['gname']) <= {'Peru Group 1'}
+
+
+def _counting(init, calls):
+    def counted(self, terrorism, previous=None, countries=()):
+        calls.append(set(countries) if previous is not None else None)
+        init(self, terrorism, previous, countries)
+    return counted
+
+
+def test_two_updates_in_a_row(cache, tmp_path):
+    path, cache_path = cache
+    use_everything()
+    data.apply_update(write_delta(str(tmp_path / 'd1.csv'), path, 'Peru', 1), path, cache_path)
+    data.apply_update(write_delta(str(tmp_path / 'd2.csv'), path, 'Chile', 2), path, cache_path)
+
+    assert data.reload(path, cache_path)
+    assert_matches_full_rebuild(cache)
+
+
+def test_update_landing_during_a_reload(cache, tmp_path, monkeypatch):
+    path, cache_path = cache
+    use_everything()
+    data.apply_update(write_delta(str(tmp_path / 'd1.csv'), path, 'Peru', 1), path, cache_path)
+    d2 = write_delta(str(tmp_path / 'd2.csv'), path, 'Chile', 2)
+
+    # the second update lands after reload() saw the first one, before it loads
+    cache_is_fresh = data.cache_is_fresh
+
+    def update_first(*args):
+        monkeypatch.setattr(data, 'cache_is_fresh', cache_is_fresh)
+        data.apply_update(d2, path, cache_path)
+        return cache_is_fresh(*args)
+    monkeypatch.setattr(data, 'cache_is_fresh', update_first)
+
+    assert data.reload(path, cache_path)
+    assert data.current().version.endswith('-r2')
+    assert_matches_full_rebuild(cache)
+
+
+def test_read_revision_waits_for_matching_files(cache, monkeypatch):
+    path, cache_path = cache
+    meta, events, summary = data.read_revision(cache_path)
+    # the events of the next revision are written, its meta not yet
+    new_meta = dict(meta, revision=1)
+    data._write_revision(cache_path, events.to_pandas(), summary.to_pandas(), new_meta)
+    data._write_json(data._meta_path(cache_path), meta)
+
+    sleeps = []
+
+    def finish_update(seconds):
+        sleeps.append(seconds)
+        data._write_json(data._meta_path(cache_path), new_meta)
+    monkeypatch.setattr(data.time, 'sleep', finish_update)
+
+    assert data.read_revision(cache_path)[0] == new_meta
+    assert len(sleeps) == 1
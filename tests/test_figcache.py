@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from apps import figcache
+
+
+class Backend:
+
+    def version(self):
+        return 'test'
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """An empty figure cache and figure registries, restored after the test."""
+    cache = figcache.FigureCache(maxsize=16, directory=None)
+    monkeypatch.setattr(figcache, 'cache', cache)
+    monkeypatch.setattr(figcache, 'figures', {})
+    monkeypatch.setattr(figcache, '_siblings', {})
+    monkeypatch.setattr(figcache.query, 'get_backend', Backend)
+    monkeypatch.setattr(figcache, 'PREFETCH_THREADS', 2)
+    return cache
+
+
+def fire_together(*calls):
+    """Run the ``calls`` in threads released at the same moment, like Dash fires siblings."""
+    barrier = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+
+    def run(i, func, args):
+        barrier.wait()
+        results[i] = func(*args)
+    threads = [threading.Thread(target=run, args=(i, func, args)) for i, (func, args) in enumerate(calls)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def sibling_pair(computed):
+    # stand-ins for plot_cities_map and plot_cities_barchart, slow enough to overlap
+    @figcache.cached_figure
+    def pair_map(provstates, cities, date_range, country):
+        computed['map'] += 1
+        time.sleep(0.2)
+        return {'data': [{'type': 'scattergeo', 'name': country}]}
+
+    @figcache.cached_figure
+    def pair_bar(provstates, cities, date_range, country):
+        computed['bar'] += 1
+        time.sleep(0.1)
+        return {'data': [{'type': 'bar', 'name': country}]}
+
+    figcache.siblings('pair_map', 'pair_bar')
+    return pair_map, pair_bar
+
+
+@pytest.mark.parametrize('run', range(5))
+def test_siblings_fired_together_are_computed_once(cache, run):
+    computed = {'map': 0, 'bar': 0}
+    pair_map, pair_bar = sibling_pair(computed)
+    args = ([''], [''], [480, 563], 'Iraq')
+
+    figure_map, figure_bar = fire_together((pair_map, args), (pair_bar, args))
+
+    assert computed == {'map': 1, 'bar': 1}
+    assert figure_map['data'][0]['type'] == 'scattergeo'
+    assert figure_bar['data'][0]['type'] == 'bar'
+    assert cache.stats()['prefetches'] == 1
+    assert cache.stats()['pending_hits'] == 1
+    assert pair_map(*args) is figure_map
+
+
+def test_same_figure_fired_together_is_computed_once(cache):
+    computed = {'map': 0, 'bar': 0}
+    pair_map, _ = sibling_pair(computed)
+    args = ([''], [''], [480, 563], 'Iraq')
+
+    fire_together(*[(pair_map, args)] * 4)
+
+    assert computed['map'] == 1
+    assert computed['bar'] == 1
+
+
+def test_failed_computation_is_not_left_pending(cache):
+    calls = []
+
+    @figcache.cached_figure
+    def failing(x):
+        calls.append(x)
+        raise ValueError(x)
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            failing(1)
+    assert calls == [1, 1]
+    assert cache.stats()['pending'] == 0
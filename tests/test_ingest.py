@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from apps import data, ingest
+
+
+@pytest.fixture(scope='module')
+def partitions(csv_path, tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp('partitions') / 'gtd')
+    # small chunks, so that years span several of them
+    ingest.ingest(csv_path, directory, chunksize=700)
+    return directory
+
+
+def assert_same_events(terrorism, expected):
+    """Same rows and values; the categories are only those of the events read."""
+    assert list(terrorism.columns) == list(expected.columns)
+    assert len(terrorism) == len(expected)
+    for column in expected.columns:
+        assert terrorism[column].dtype.name == expected[column].dtype.name, column
+        assert terrorism[column].astype(object).where(terrorism[column].notna(), None).tolist() == \
+            expected[column].astype(object).where(expected[column].notna(), None).tolist(), column
+        if expected[column].dtype.name == 'category':
+            categories = list(terrorism[column].cat.categories)
+            assert categories == sorted(terrorism[column].dropna().unique()), column
+
+
+def test_partitions_hold_the_cleaned_frame(partitions, snapshot):
+    assert_same_events(ingest.read_partitions(partitions), snapshot.terrorism)
+
+
+@pytest.mark.parametrize('years', [[2000, 2010], [1985, 1985], [2020, 2030]])
+def test_partitions_of_a_range_of_years(partitions, snapshot, years):
+    expected = snapshot.terrorism[snapshot.terrorism['iyear'].between(*years)].reset_index(drop=True)
+    assert_same_events(ingest.read_partitions(partitions, years), expected)
+
+
+def test_manifest_counts_the_rows_of_each_year(partitions, snapshot):
+    rows = ingest.read_manifest(partitions)['rows']
+    expected = snapshot.terrorism['iyear'].value_counts()
+    assert {int(y): n for y, n in rows.items()} == expected.to_dict()
+    assert ingest.partition_years(partitions) == sorted(expected.index)
+
+
+def test_summaries_of_the_partitions(partitions, snapshot):
+    ids, values = data._load_summaries(partitions, None)
+    assert (np.diff(ids) > 0).all()
+    expected_ids, expected_values = snapshot.summaries()
+    np.testing.assert_array_equal(ids, expected_ids)
+    assert values.to_pylist() == expected_values.to_pylist()
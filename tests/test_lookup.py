@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from apps import lookup
+
+
+def expected_rows(terrorism, country, start=None, end=None, **selections):
+    """The rows of ``lookup.EventIndex.rows``, with a plain pandas filter."""
+    mask = (terrorism['country_txt'] == country).values
+    if start is not None:
+        mask &= (terrorism['date'] >= pd.Timestamp(start)).values
+    if end is not None:
+        mask &= (terrorism['date'] <= pd.Timestamp(end)).values
+    if selections:
+        selected = np.zeros(len(terrorism), dtype=bool)
+        for column, values in selections.items():
+            selected |= terrorism[column].isin(values).values
+        mask &= selected
+    rows = np.flatnonzero(mask)
+    # date order; the frame is sorted by (country, date)
+    return rows[np.argsort(terrorism['date'].values[rows], kind='mergesort')]
+
+
+def top_values(terrorism, country, column, n):
+    return terrorism.loc[terrorism['country_txt'] == country, column].value_counts().index[:n].tolist()
+
+
+@pytest.mark.parametrize('country', ['Iraq', 'Peru', 'Country 150', 'Atlantis'])
+@pytest.mark.parametrize('dates', [(None, None), ('2010-01-01', '2016-12-01'), ('1985-03-01', '1985-03-01'),
+                                   ('2020-01-01', None), (None, '1969-01-01')])
+def test_rows_match_a_pandas_filter(terrorism, country, dates):
+    index = lookup.get_index()
+    np.testing.assert_array_equal(index.rows(country, *dates), expected_rows(terrorism, country, *dates))
+
+
+@pytest.mark.parametrize('column', lookup.POSTING_COLUMNS)
+@pytest.mark.parametrize('country', ['Iraq', 'Peru'])
+def test_posting_lists_match_a_pandas_filter(terrorism, column, country):
+    index = lookup.get_index()
+    values = top_values(terrorism, country, column, 3) + ['not a value']
+    for start, end in [(None, None), ('2000-01-01', '2010-12-01')]:
+        np.testing.assert_array_equal(index.rows(country, start, end, **{column: values}),
+                                      expected_rows(terrorism, country, start, end, **{column: values}))
+        np.testing.assert_array_equal(index.rows(country, start, end, **{column: values[:1]}),
+                                      expected_rows(terrorism, country, start, end, **{column: values[:1]}))
+
+
+def test_selections_on_several_columns_match_any(terrorism):
+    index = lookup.get_index()
+    selections = {'provstate': top_values(terrorism, 'Iraq', 'provstate', 1),
+                  'city': top_values(terrorism, 'Iraq', 'city', 2)}
+    np.testing.assert_array_equal(index.rows('Iraq', '1990-01-01', None, **selections),
+                                  expected_rows(terrorism, 'Iraq', '1990-01-01', None, **selections))
+
+
+def test_values_are_the_sorted_distinct_values(terrorism):
+    index = lookup.get_index()
+    for column in lookup.POSTING_COLUMNS:
+        expected = sorted(terrorism.loc[terrorism['country_txt'] == 'Peru', column].dropna().unique())
+        assert index.values('Peru', column) == expected
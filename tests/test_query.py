@@ -0,0 +1,95 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from apps import data, query
+
+COUNTRIES = ['Iraq', 'Peru', 'Country 150', 'Atlantis']
+
+
+@pytest.fixture(scope='session')
+def databases(snapshot, tmp_path_factory):
+    """Query databases of the ``snapshot`` dataset, by engine."""
+    directory = tmp_path_factory.mktemp('db')
+    paths = {}
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(data, '_snapshot', snapshot)
+        for engine in sorted(query.ENGINES):
+            if engine == 'duckdb' and query.duckdb is None:
+                continue
+            paths[engine] = query.build(engine, str(directory / ('gtd.' + engine)))
+    return paths
+
+
+@pytest.fixture(params=sorted(query.ENGINES))
+def backend(request, databases, terrorism):
+    if request.param not in databases:
+        pytest.skip('{} is not installed'.format(request.param))
+    return query.ENGINES[request.param](databases[request.param])
+
+
+@pytest.fixture
+def pandas_backend(terrorism):
+    return query.PandasBackend()
+
+
+def assert_same_events(got, expected):
+    assert len(got) == len(expected)
+    for column in query.EVENT_COLUMNS:
+        left, right = got[column].values, expected[column].values
+        if column == 'date':
+            np.testing.assert_array_equal(left.astype('datetime64[D]'), right.astype('datetime64[D]'))
+        elif left.dtype.kind == 'f' or right.dtype.kind == 'f':
+            np.testing.assert_allclose(left.astype('float64'), right.astype('float64'), rtol=1e-6)
+        else:
+            assert [None if v != v else v for v in left.tolist()] == \
+                   [None if v != v else v for v in np.asarray(right, dtype=object).tolist()], column
+
+
+def test_version_and_countries(backend, pandas_backend):
+    assert backend.version() == pandas_backend.version()
+    assert backend.countries() == pandas_backend.countries()
+
+
+@pytest.mark.parametrize('column', ['provstate', 'city', 'gname'])
+def test_values(backend, pandas_backend, column):
+    for country in COUNTRIES:
+        assert backend.values(country, column) == pandas_backend.values(country, column)
+
+
+@pytest.mark.parametrize('measure', sorted(query.MEASURES))
+@pytest.mark.parametrize('years', [[1970, 2016], [2001, 2003], [2020, 2030]])
+def test_aggregates(backend, pandas_backend, measure, years):
+    for country in COUNTRIES:
+        for got, expected in zip(backend.annual(country, years, measure),
+                                 pandas_backend.annual(country, years, measure)):
+            np.testing.assert_allclose(np.asarray(got, dtype='float64'), expected, rtol=1e-5)
+    got, expected = backend.top(years, measure, n=None), pandas_backend.top(years, measure, n=None)
+    assert got[0] == expected[0]
+    np.testing.assert_allclose(np.asarray(got[1], dtype='float64'), expected[1], rtol=1e-5)
+
+
+@pytest.mark.parametrize('countries', [[''], ['Iraq'], ['Iraq', 'Peru', 'Atlantis']])
+def test_world_events(backend, pandas_backend, countries):
+    for years in [[1970, 2016], [2010, 2012]]:
+        assert_same_events(backend.world_events(countries, years), pandas_backend.world_events(countries, years))
+
+
+def test_events(backend, pandas_backend, terrorism):
+    iraq = terrorism[terrorism['country_txt'] == 'Iraq']
+    start, end = datetime.date(2005, 1, 1), datetime.date(2016, 12, 1)
+    cases = [{}, {'provstate': iraq['provstate'].value_counts().index[:2].tolist()},
+             {'city': [iraq['city'].value_counts().index[0], 'not a city']},
+             {'gname': iraq['gname'].value_counts().index[:3].tolist(), 'provstate': ['']},
+             {'gname': ['']}]
+    for selections in cases:
+        for country in COUNTRIES:
+            for dates in [(None, None), (start, end)]:
+                assert_same_events(backend.events(country, *dates, **selections),
+                                   pandas_backend.events(country, *dates, **selections))
+
+
+def test_summaries(backend, pandas_backend, terrorism):
+    eventids = list(terrorism['eventid'].values[::97]) + [1, terrorism['eventid'].values[0]]
+    assert list(backend.summaries(eventids)) == list(pandas_backend.summaries(eventids))
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from apps import rollups
+
+MEASURES = {'counts': ('eventid', 'count'), 'deaths': ('nkill', 'sum'), 'wounds': ('nwound', 'sum')}
+
+
+def expected_totals(terrorism, years, measure):
+    """Per-country totals with a plain pandas groupby."""
+    column, how = MEASURES[measure]
+    events = terrorism[terrorism['iyear'].between(years[0], years[1])]
+    totals = events.groupby('country_txt', observed=True)[column].agg(how).astype('float64')
+    return totals[totals > 0]
+
+
+@pytest.mark.parametrize('measure', sorted(MEASURES))
+@pytest.mark.parametrize('years', [[1970, 2016], [2010, 2016], [1985, 1985], [2016, 2016],
+                                   # outside the years of the data (see TERRORISM_YEARS)
+                                   [1950, 1975], [2012, 2030], [2020, 2030], [1950, 1960]])
+def test_top_matches_a_groupby(terrorism, measure, years):
+    countries, values = rollups.get_cube().top(years, measure, n=None)
+    expected = expected_totals(terrorism, years, measure)
+    assert sorted(countries) == sorted(expected.index)
+    np.testing.assert_allclose(values, expected[countries].values, rtol=1e-5)
+    assert list(values) == sorted(values)
+
+
+def test_top_keeps_the_largest(terrorism):
+    countries, values = rollups.get_cube().top([2000, 2016], 'counts', n=5)
+    expected = expected_totals(terrorism, [2000, 2016], 'counts')
+    assert len(countries) == 5
+    assert min(values) >= expected.sort_values().iloc[-5]
+
+
+@pytest.mark.parametrize('measure', sorted(MEASURES))
+@pytest.mark.parametrize('country', ['Iraq', 'Chile', 'Country 150', 'Atlantis'])
+@pytest.mark.parametrize('years', [[1970, 2016], [1999, 2004], [2020, 2030]])
+def test_annual_matches_a_groupby(terrorism, measure, country, years):
+    column, how = MEASURES[measure]
+    events = terrorism[(terrorism['country_txt'] == country) & terrorism['iyear'].between(years[0], years[1])]
+    expected = events.groupby('iyear')[column].agg(how)
+
+    year_values, values = rollups.get_cube().annual(country, years, measure)
+    np.testing.assert_array_equal(year_values, expected.index.values)
+    np.testing.assert_allclose(values, expected.values.astype('float64'), rtol=1e-5)
+
+
+def test_a_cube_of_fewer_years_answers_ranges_past_them(terrorism):
+    # a dataset loaded with TERRORISM_YEARS=2000-2010
+    cube = rollups.CountryYearCube(terrorism[terrorism['iyear'].between(2000, 2010)])
+    countries, values = cube.top([2012, 2016])
+    assert countries == [] and len(values) == 0
+    assert len(cube.totals([2012, 2016])) == len(cube.countries)
+    assert cube.top([2008, 2016], n=None)[0] == cube.top([2008, 2010], n=None)[0]
+    assert len(cube.annual('Iraq', [2012, 2016])[0]) == 0